@@ -13,10 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0326,w0406,e0401,e0611
+from datetime import datetime
 from functools import wraps
-import requests
-import yaml
+import time
 from flask import request, Blueprint, abort
+from sojobo_api.api import w_bundles as bundles
 from sojobo_api.api.w_juju import create_response
 from sojobo_api import settings
 
@@ -44,43 +45,22 @@ def authenticate(func):
 @BUNDLES.route('', methods=['GET'])
 @authenticate
 def get_bundles():
-    i = 1
-    res = requests.get('https://api.github.com/orgs/{}/repos'.format(REPO))
-    data = []
-    while res.json() != [] and res.status_code == 200:
-        for b in res.json():
-            if 'bundle' in b['name']:
-                data.append({
-                    'name': b['name'],
-                    'description': b['description'],
-                    'json': get_json(b['name']),
-                    'logo': None
-                })
-        i += 1
-        res = requests.get('https://api.github.com/orgs/{}/repos?page={}'.format(REPO, i))
-    return create_response(200, data)
+    return catalog_response(200, bundles.get_bundles())
 
 
 @BUNDLES.route('/<bundle>', methods=['GET'])
 @authenticate
 def get_bundle(bundle):
-    res = requests.get('https://api.github.com/repos/{}/{}'.format(REPO, bundle))
-    if res.status_code == 200:
-        data = {
-            'name': res.json()['name'],
-            'description': res.json()['description'],
-            'json': get_json(res.json()['name']),
-            'logo': None
-        }
-        return create_response(200, data)
-    else:
+    data = bundles.get_bundle(bundle)
+    if data is None:
         abort(404, 'The bundle {}:{} could not be found'.format(REPO, bundle))
+    return catalog_response(200, data)
 
 
-def get_json(bundle):
-    res = requests.get('https://raw.githubusercontent.com/{}/{}/master/bundle.yaml'.format(REPO, bundle))
-    if res.status_code == 200:
-        res_dict = yaml.load(res.text)
-        return res_dict
-    else:
-        abort(404, 'The bundle {}:{} could not be found'.format(REPO, bundle))
+def catalog_response(code, data):
+    # Bundles are served from the catalog index, these headers tell how fresh it is.
+    refreshed = bundles.get_refreshed()
+    response = create_response(code, data)
+    response.headers['Age'] = str(max(0, int(time.time() - refreshed)))
+    response.headers['X-Bundles-Refreshed'] = datetime.utcfromtimestamp(refreshed).isoformat() + 'Z'
+    return response
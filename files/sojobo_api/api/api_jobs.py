@@ -0,0 +1,101 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,w0406,e0401,e0611
+import sys
+import traceback
+import logging
+from werkzeug.exceptions import HTTPException
+from flask import request, Blueprint
+from sojobo_api import settings
+from sojobo_api.api import w_errors as errors, w_juju as juju, w_jobs as jobs
+from sojobo_api.api.w_juju import execute_task
+
+
+JOBS = Blueprint('jobs', __name__)
+LOGGER = logging.getLogger('api_jobs')
+LOGGER.setLevel(logging.DEBUG)
+
+def get():
+    return JOBS
+
+@JOBS.before_app_first_request
+def initialize():
+    hdlr = logging.FileHandler('/opt/sojobo_api/log/api_jobs.log')
+    hdlr.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    hdlr.setFormatter(formatter)
+    LOGGER.addHandler(hdlr)
+
+
+@JOBS.route('/', methods=['GET'])
+def get_jobs():
+    try:
+        LOGGER.info('/JOBS [GET] => receiving call')
+        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/JOBS [GET] => Authenticated!')
+        state = request.args.get('state', None)
+        limit = request.args.get('limit', '100')
+        if not limit.isdigit() or not 0 < int(limit) <= int(settings.LIST_MAX_LIMIT):
+            code, response = 400, 'The limit must be a number between 1 and {}'.format(settings.LIST_MAX_LIMIT)
+            LOGGER.error('/JOBS [GET] => Invalid limit %s!', limit)
+        elif state in [None, 'queued', 'running', 'succeeded', 'failed']:
+            code, response = 200, jobs.get_jobs(token, state, int(limit))
+            LOGGER.info('/JOBS [GET] => Succesfully retrieved jobs!')
+        else:
+            code, response = errors.invalid_option(state)
+            LOGGER.error('/JOBS [GET] => Invalid state %s!', state)
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
+@JOBS.route('/<job>', methods=['GET'])
+def get_job(job):
+    try:
+        LOGGER.info('/JOBS/%s [GET] => receiving call', job)
+        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/JOBS/%s [GET] => Authenticated!', job)
+        info = jobs.get_job(job, token)
+        if info is not None:
+            code, response = 200, info
+            LOGGER.info('/JOBS/%s [GET] => Succesfully retrieved job!', job)
+        else:
+            code, response = errors.does_not_exist('job')
+            LOGGER.error('/JOBS/%s [GET] => Job does not exist!', job)
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
+def error_log():
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
+    for l in lines:
+        LOGGER.error(l)
+    return lines
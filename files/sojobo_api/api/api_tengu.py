@@ -21,8 +21,9 @@ import sys
 import traceback
 import logging
 from werkzeug.exceptions import HTTPException
-from flask import send_file, request, Blueprint
-from sojobo_api.api import w_errors as errors, w_juju as juju, w_datastore as datastore
+from flask import send_file, request, Blueprint, Response
+from sojobo_api import settings
+from sojobo_api.api import w_errors as errors, w_juju as juju, w_datastore as datastore, w_events as events
 from sojobo_api.api.w_juju import execute_task
 
 
@@ -51,7 +52,7 @@ def get_all_controllers():
         token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
         LOGGER.info('/TENGU/controllers [GET] => Authenticated!')
         if token.is_admin:
-            code, response = 200, juju.get_all_controllers()
+            code, response = 200, juju.get_controllers_list(juju.list_options(request.args, 'state', 'type'))
             LOGGER.info('/TENGU/controllers [GET] => Succesfully retrieved all controllers!')
         else:
             code, response = errors.no_permission()
@@ -209,7 +210,7 @@ def get_models_info(controller):
         LOGGER.info('/TENGU/controllers/%s/models [GET] => Authenticated!', controller)
         con = juju.authorize( token, controller)
         LOGGER.info('/TENGU/controllers/%s/models [GET] => Authorized!', controller)
-        code, response = 200, juju.get_models_info(token, con)
+        code, response = 200, juju.get_models_info(token, con, juju.list_options(request.args, 'state'))
         LOGGER.info('/TENGU/controllers/%s/models [GET] => modelinfo retieved for all models!', controller)
     except KeyError:
         code, response = errors.invalid_data()
@@ -225,14 +226,20 @@ def get_models_info(controller):
 
 @TENGU.route('/controllers/<controller>/models/<model>', methods=['GET'])
 def get_model_info(controller, model):
+    version = None
     try:
         LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => receiving call', controller, model)
         token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
         LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => Authenticated!', controller, model)
         con, mod = juju.authorize( token, controller, model)
         LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => Authorized!', controller, model)
-        code, response = 200, execute_task(juju.get_model_info, token, con, mod)
-        LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => model information retrieved!', controller, model)
+        version = execute_task(juju.get_model_version, token, con, mod)
+        if juju.is_not_modified(request, version):
+            code, response = 304, None
+            LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => model information not modified!', controller, model)
+        else:
+            code, response = 200, execute_task(juju.get_model_info, token, con, mod)
+            LOGGER.info('/TENGU/controllers/%s/models/%s [GET] => model information retrieved!', controller, model)
     except KeyError:
         code, response = errors.invalid_data()
         error_log()
@@ -242,7 +249,7 @@ def get_model_info(controller, model):
     except Exception:
         ers = error_log()
         code, response = errors.cmd_error(ers)
-    return juju.create_response(code, response)
+    return juju.etag_response(request, version, code, response)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>', methods=['POST'])
@@ -311,7 +318,7 @@ def get_applications_info(controller, model):
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications [GET] => Authenticated!', controller, model)
         con, mod = juju.authorize( token, controller, model)
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications [GET] => Authorized!', controller, model)
-        code, response = 200, execute_task(juju.get_applications_info, token, mod)
+        code, response = 200, execute_task(juju.get_applications_info, token, mod, juju.list_options(request.args, 'state'))
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications [GET] => succesfully retieved applications info!', controller, model)
     except KeyError:
         code, response = errors.invalid_data()
@@ -360,6 +367,7 @@ def add_application(controller, model):
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>', methods=['GET'])
 def get_application_info(controller, model, application):
+    version = None
     try:
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s [GET] => receiving call', controller, model, application)
         token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
@@ -367,8 +375,13 @@ def get_application_info(controller, model, application):
         con, mod = juju.authorize( token, controller, model)
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s [GET] => authorized!', controller, model, application)
         if execute_task(juju.app_exists, token, con, mod, application):
-            code, response = 200, execute_task(juju.get_application_info, token, mod, application)
-            LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s [GET] => Succesfully retrieved application info!', controller, model, application)
+            version = execute_task(juju.get_application_version, mod, application)
+            if juju.is_not_modified(request, version):
+                code, response = 304, None
+                LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s [GET] => Application info not modified!', controller, model, application)
+            else:
+                code, response = 200, execute_task(juju.get_application_info, token, mod, application)
+                LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s [GET] => Succesfully retrieved application info!', controller, model, application)
         else:
             code, response = errors.does_not_exist('application')
             LOGGER.error('/TENGU/controllers/%s/models/%s/applications/%s [GET] => Application does not exist!', controller, model, application)
@@ -381,7 +394,7 @@ def get_application_info(controller, model, application):
     except Exception:
         ers = error_log()
         code, response = errors.cmd_error(ers)
-    return juju.create_response(code, response)
+    return juju.etag_response(request, version, code, response)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>', methods=['PUT'])
@@ -506,7 +519,7 @@ def get_machines_info(controller, model):
         LOGGER.info('/TENGU/controllers/%s/models/%s/machines [GET] => Authenticated!', controller, model)
         con, mod = juju.authorize( token, controller, model)
         LOGGER.info('/TENGU/controllers/%s/models/%s/machines [GET] => Authorized!', controller, model)
-        code, response = 200, execute_task(juju.get_machines_info, token, mod)
+        code, response = 200, execute_task(juju.get_machines_info, token, mod, juju.list_options(request.args, 'series', 'application'))
         LOGGER.info('/TENGU/controllers/%s/models/%s/machines [GET] => Succesfully retrieved machine information!', controller, model)
     except KeyError:
         code, response = errors.invalid_data()
@@ -707,7 +720,7 @@ def remove_unit(controller, model, application, unitnumber):
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s/units/%s [DELETE] => Authenticated!', controller, model, application, unitnumber)
         con, mod = juju.authorize( token, controller, model)
         LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s/units/%s [DELETE] => Authorized!', controller, model, application, unitnumber)
-        if execute_task(juju.get_unit_info, token, mod, application, unitnumber) is not {}:
+        if execute_task(juju.unit_exists, token, mod, application, unitnumber):
             if mod.m_access == 'write' or mod.m_access == 'admin':
                 execute_task(juju.remove_unit, token, mod, application, unitnumber)
                 LOGGER.info('/TENGU/controllers/%s/models/%s/applications/%s/units/%s [DELETE] => Unit is being removed!', controller, model, application, unitnumber)
@@ -843,6 +856,116 @@ def remove_relation(controller, model, app1, app2):
     return juju.create_response(code, response)
 
 
+@TENGU.route('/controllers/<controller>/models/<model>/events', methods=['GET'])
+def get_model_events(controller, model):
+    try:
+        LOGGER.info('/TENGU/controllers/%s/models/%s/events [GET] => receiving call', controller, model)
+        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/TENGU/controllers/%s/models/%s/events [GET] => Authenticated!', controller, model)
+        con, mod = juju.authorize( token, controller, model)
+        LOGGER.info('/TENGU/controllers/%s/models/%s/events [GET] => Authorized!', controller, model)
+        subscription = events.Subscription()
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            execute_task(events.subscribe_model, controller, mod, subscription)
+            LOGGER.info('/TENGU/controllers/%s/models/%s/events [GET] => Streaming events!', controller, model)
+            return Response(stream_events(controller, mod, subscription), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        timeout = min(float(request.args.get('timeout', settings.EVENTS_POLL_TIMEOUT)), float(settings.EVENTS_POLL_TIMEOUT))
+        execute_task(events.subscribe_model, controller, mod, subscription)
+        try:
+            code, response = 200, events.poll(subscription, timeout)
+        finally:
+            execute_task(events.unsubscribe_model, controller, mod, subscription)
+        LOGGER.info('/TENGU/controllers/%s/models/%s/events [GET] => %s events returned!', controller, model, len(response))
+    except (KeyError, ValueError):
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
+def stream_events(controller, model, subscription):
+    try:
+        while True:
+            event = subscription.get(float(settings.EVENTS_KEEPALIVE))
+            yield events.keepalive() if event is None else events.to_sse(event)
+    finally:
+        execute_task(events.unsubscribe_model, controller, model, subscription)
+
+
+@TENGU.route('/controller-types', methods=['GET'])
+def get_controller_types():
+    try:
+        LOGGER.info('/TENGU/controller-types [GET] => receiving call')
+        execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/TENGU/controller-types [GET] => Authenticated!')
+        code, response = 200, juju.get_controller_types_info()
+        LOGGER.info('/TENGU/controller-types [GET] => Succesfully retrieved controller types!')
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/controller-types', methods=['PUT'])
+def reload_controller_types():
+    try:
+        LOGGER.info('/TENGU/controller-types [PUT] => receiving call')
+        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/TENGU/controller-types [PUT] => Authenticated!')
+        if token.is_admin:
+            code, response = 200, juju.reload_controller_types()
+            LOGGER.info('/TENGU/controller-types [PUT] => Succesfully reloaded controller types!')
+        else:
+            code, response = errors.no_permission()
+            LOGGER.error('/TENGU/controller-types [PUT] => No Permission to perform action!')
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/stats', methods=['GET'])
+def get_stats():
+    try:
+        LOGGER.info('/TENGU/stats [GET] => receiving call')
+        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        LOGGER.info('/TENGU/stats [GET] => Authenticated!')
+        if token.is_admin:
+            code, response = 200, juju.get_stats()
+            LOGGER.info('/TENGU/stats [GET] => Succesfully retrieved stats!')
+        else:
+            code, response = errors.no_permission()
+            LOGGER.error('/TENGU/stats [GET] => No Permission to perform action!')
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException:
+        ers = error_log()
+        raise
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    return juju.create_response(code, response)
+
+
 # On hold
 # TO DO: Backup and restore calls
 @TENGU.route('/backup', methods=['GET'])
@@ -71,7 +71,7 @@ def get_users_info():
         LOGGER.info('/USERS [GET] => receiving call')
         token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
         LOGGER.info('/USERS [GET] => Authenticated!')
-        code, response = 200, juju.get_users_info(token)
+        code, response = 200, juju.get_users_info(token, juju.list_options(request.args, 'state'))
         LOGGER.info('/USERS [GET] => Succesfully retieved all users!')
     except KeyError:
         code, response = errors.invalid_data()
@@ -124,14 +124,20 @@ def create_user():
 
 @USERS.route('/<user>', methods=['GET'])
 def get_user_info(user):
+    version = None
     try:
         LOGGER.info('/USERS/%s [GET] => receiving call', user)
         token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
         LOGGER.info('/USERS/%s [GET] => Authenticated!', user)
         if user == token.username or token.is_admin:
             if juju.user_exists(user):
-                code, response = 200, juju.get_user_info(user)
-                LOGGER.info('/USERS/%s [GET] => Succesfully retrieved user information!', user)
+                version = juju.get_user_version(user)
+                if juju.is_not_modified(request, version):
+                    code, response = 304, None
+                    LOGGER.info('/USERS/%s [GET] => User information not modified!', user)
+                else:
+                    code, response = 200, juju.get_user_info(user)
+                    LOGGER.info('/USERS/%s [GET] => Succesfully retrieved user information!', user)
             else:
                 code, response = errors.does_not_exist('user')
                 LOGGER.error('/USERS/%s [GET] => User %s does not exist!', user, user)
@@ -147,7 +153,7 @@ def get_user_info(user):
     except Exception:
         ers = error_log()
         code, response = errors.cmd_error(ers)
-    return juju.create_response(code, response)
+    return juju.etag_response(request, version, code, response)
 
 
 @USERS.route('/<user>', methods=['PUT'])
@@ -160,9 +166,16 @@ def change_user_password(user):
             if juju.user_exists(user):
                 pwd = request.json['password']
                 if pwd:
-                    execute_task(juju.change_user_password, token, user, pwd)
-                    code, response = 200, 'Succesfully changed password for user {}'.format(user)
-                    LOGGER.info('/USERS/%s [PUT] => Succesfully changed password for user %s!', user, user)
+                    results = execute_task(juju.change_user_password, token, user, pwd)
+                    failed = juju.fan_out_failed(results)
+                    if failed:
+                        code, response = 502, {'message': 'Password of user {} could not be changed on controllers {}'.format(user, ', '.join(failed)),
+                                               'controllers': results}
+                        LOGGER.error('/USERS/%s [PUT] => Changing password failed on controllers %s!', user, failed)
+                    else:
+                        code, response = 200, {'message': 'Succesfully changed password for user {}'.format(user),
+                                               'controllers': results}
+                        LOGGER.info('/USERS/%s [PUT] => Succesfully changed password for user %s!', user, user)
                 else:
                     code, response = errors.empty()
                     LOGGER.error('/USERS/%s [PUT] => User password can\'t be empty!', user)
@@ -0,0 +1,224 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+from threading import Lock, Thread
+import time
+import requests
+import yaml
+from sojobo_api import settings
+from sojobo_api.api import w_datastore as datastore
+################################################################################
+# FETCHER
+################################################################################
+# Everything the catalog needs from GitHub goes through a fetcher, point the
+# BUNDLE_API_URL and BUNDLE_RAW_URL settings at another server (or call
+# set_fetcher) to run the catalog against a stand-in.
+class Fetcher(object):
+    def __init__(self, api_url, raw_url, timeout):
+        self.api_url = api_url.rstrip('/')
+        self.raw_url = raw_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def repos_url(self, repo, page):
+        return '{}/orgs/{}/repos?page={}'.format(self.api_url, repo, page)
+
+    def bundle_url(self, repo, bundle):
+        return '{}/{}/{}/master/bundle.yaml'.format(self.raw_url, repo, bundle)
+
+    def get(self, url, validator=None):
+        # A conditional request with the ETag or Last-Modified of the previous
+        # response, a 304 answer costs GitHub nothing and sends no body.
+        headers = {}
+        if validator and validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator and validator.get('modified'):
+            headers['If-Modified-Since'] = validator['modified']
+        res = self.session.get(url, headers=headers, timeout=self.timeout)
+        return res.status_code, res.text, {'etag': res.headers.get('ETag'),
+                                           'modified': res.headers.get('Last-Modified'),
+                                           'link': res.headers.get('Link', '')}
+################################################################################
+# CATALOG
+################################################################################
+# The bundles of the repo are kept in an index, in memory and in a file that is
+# shared by all processes. Requests are served from the index, which is
+# refreshed in the background once it is older than BUNDLE_REFRESH_INTERVAL.
+# Only one process refreshes at a time, the others reload the file.
+#   {'refreshed': <time>, 'pages': {<url>: {validator, 'repos': [...]}},
+#    'bundles': {<name>: {name, description, json, logo, validator}}}
+REFRESH_LOCK_KEY = '_lock:bundles'
+LAST_PAGE = re.compile(r'[?&]page=(\d+)>; rel="last"')
+
+
+class BundleCatalog(object):
+    def __init__(self, repo, fetcher, path, interval, workers):
+        self.repo = repo
+        self.fetcher = fetcher
+        self.path = path
+        self.interval = interval
+        self.executor = ThreadPoolExecutor(workers)
+        self.index = {'refreshed': 0, 'pages': {}, 'bundles': {}}
+        self.lock = Lock()
+        self.refreshing = False
+        self.attempted = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if index.get('repo') == self.repo and index['refreshed'] > self.index['refreshed']:
+            self.index = index
+
+    def save(self):
+        tmp_path = '{}.{}'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as index_file:
+            json.dump(dict(self.index, repo=self.repo), index_file)
+        os.replace(tmp_path, self.path)
+
+    def age(self):
+        return time.time() - self.index['refreshed']
+
+    def get_index(self):
+        if self.age() > self.interval:
+            self.load()
+        if not self.index['refreshed']:
+            # Nothing to serve yet, the very first refresh is waited for, also
+            # when another process does it.
+            deadline = time.time() + float(settings.BUNDLE_FETCH_TIMEOUT) * 6
+            while not self.index['refreshed'] and time.time() < deadline:
+                if not self.refresh():
+                    time.sleep(0.5)
+                    self.load()
+        elif self.age() > self.interval:
+            self.refresh_background()
+        return self.index
+
+    def refresh_background(self):
+        with self.lock:
+            # A failed refresh is not retried by every request that follows.
+            if self.refreshing or time.time() - self.attempted < min(self.interval, 60):
+                return
+            self.refreshing = True
+        Thread(target=self.refresh, name='bundle-catalog', daemon=True).start()
+
+    def refresh(self):
+        con = datastore.connect_to_jobs()
+        self.attempted = time.time()
+        try:
+            if not con.set(REFRESH_LOCK_KEY, os.getpid(), nx=True, ex=int(self.interval)):
+                return False
+            try:
+                index = self.fetch_index()
+            finally:
+                con.delete(REFRESH_LOCK_KEY)
+            with self.lock:
+                self.index = index
+            self.save()
+            return True
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def fetch_index(self):
+        old = self.index
+        pages = {}
+        first = self.fetch_page(old, pages, 1)
+        last = LAST_PAGE.search(first or '')
+        # The Link header of the first page tells how many pages there are.
+        list(self.executor.map(lambda page: self.fetch_page(old, pages, page),
+                               range(2, int(last.group(1)) + 1 if last else 2)))
+        repos = [r for page in pages.values() for r in page['repos'] if 'bundle' in r['name']]
+        bundles = {}
+        for repo, bundle in zip(repos, self.executor.map(lambda r: self.fetch_bundle(old, r), repos)):
+            if bundle is not None:
+                bundles[repo['name']] = bundle
+        return {'refreshed': time.time(), 'pages': pages, 'bundles': bundles}
+
+    def fetch_page(self, old, pages, page):
+        url = self.fetcher.repos_url(self.repo, page)
+        cached = old['pages'].get(url)
+        status, body, validator = self.fetcher.get(url, cached and cached['validator'])
+        if status == 304 and cached:
+            pages[url] = cached
+        elif status == 200:
+            pages[url] = {'validator': validator,
+                          'repos': [{'name': r['name'], 'description': r['description']} for r in json.loads(body)]}
+        else:
+            # Without a complete list of repos the current index is kept.
+            raise requests.HTTPError('{} returned {}'.format(url, status))
+        return pages[url]['validator']['link']
+
+    def fetch_bundle(self, old, repo):
+        cached = old['bundles'].get(repo['name'])
+        status, body, validator = self.fetcher.get(self.fetcher.bundle_url(self.repo, repo['name']),
+                                                   cached and cached['validator'])
+        if status == 304 and cached:
+            return dict(cached, description=repo['description'])
+        if status == 200:
+            return {'name': repo['name'],
+                    'description': repo['description'],
+                    'json': yaml.safe_load(body),
+                    'logo': None,
+                    'validator': validator}
+        # A repo without a bundle.yaml is no bundle, on other errors the bundle
+        # is kept as it was.
+        return None if status == 404 else cached
+
+    def get_bundles(self):
+        index = self.get_index()
+        return [bundle_document(index['bundles'][b]) for b in sorted(index['bundles'])]
+
+    def get_bundle(self, bundle):
+        bundle = self.get_index()['bundles'].get(bundle)
+        return bundle_document(bundle) if bundle else None
+
+
+def bundle_document(bundle):
+    return {k: bundle[k] for k in ['name', 'description', 'json', 'logo']}
+
+
+CATALOG = {}
+
+
+def get_catalog():
+    if 'catalog' not in CATALOG:
+        set_fetcher(Fetcher(settings.BUNDLE_API_URL, settings.BUNDLE_RAW_URL, float(settings.BUNDLE_FETCH_TIMEOUT)))
+    return CATALOG['catalog']
+
+
+def set_fetcher(fetcher):
+    CATALOG['catalog'] = BundleCatalog(settings.REPO_NAME, fetcher, settings.BUNDLE_INDEX,
+                                       float(settings.BUNDLE_REFRESH_INTERVAL), int(settings.BUNDLE_FETCH_WORKERS))
+
+
+def get_bundles():
+    return get_catalog().get_bundles()
+
+
+def get_bundle(bundle):
+    return get_catalog().get_bundle(bundle)
+
+
+def get_refreshed():
+    return get_catalog().index['refreshed']
@@ -0,0 +1,159 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+from collections import OrderedDict
+import os
+from threading import Lock
+import time
+from sojobo_api import settings
+from sojobo_api.api import w_datastore as datastore, w_events as events
+################################################################################
+# DOCUMENT CACHE
+################################################################################
+# Controller and user documents read by authorize() are kept per process. The
+# datastore writers drop them here at once and in every other process through
+# the invalidation channel, the TTL only bounds how long a lost message lasts.
+# Cached documents are shared between requests and must not be changed.
+class DocumentCache(object):
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.documents = OrderedDict()
+        self.lock = Lock()
+        self.generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'evicted': 0}
+
+    def get(self, key, loader):
+        now = time.time()
+        with self.lock:
+            entry = self.documents.get(key)
+            if entry is not None and entry[0] > now:
+                self.documents.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+            generation = self.generation
+        document = loader()
+        # Missing documents are not cached, they are created right after. Nor
+        # is a document that may have been invalidated while it was read.
+        if document is not None and self.ttl > 0:
+            with self.lock:
+                if generation != self.generation:
+                    return document
+                self.documents[key] = (now + self.ttl, document)
+                self.documents.move_to_end(key)
+                while len(self.documents) > self.max_size:
+                    self.documents.popitem(last=False)
+                    self.stats['evicted'] += 1
+        return document
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.documents.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.documents.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+    def store(self, key, document):
+        with self.lock:
+            self.documents[key] = (time.time() + self.ttl, document)
+            self.documents.move_to_end(key)
+            while len(self.documents) > self.max_size:
+                self.documents.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def invalidate(self, kind, names):
+        with self.lock:
+            self.generation += 1
+            for name in names:
+                if self.documents.pop((kind, name), None) is not None:
+                    self.stats['invalidated'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.documents), pid=os.getpid())
+
+
+CACHE = DocumentCache(int(settings.AUTHORIZE_CACHE_SIZE), float(settings.AUTHORIZE_CACHE_TTL))
+CACHE_PID = None
+CACHE_LOCK = Lock()
+# The ETag of a response by the versions of everything it was built from. The
+# versions are part of the key, so entries never go stale, they only expire.
+ETAGS = DocumentCache(int(settings.ETAG_CACHE_SIZE), float(settings.ETAG_CACHE_TTL))
+
+
+def get_cache():
+    global CACHE_PID  #pylint: disable=W0603
+    with CACHE_LOCK:
+        if CACHE_PID != os.getpid():
+            # Invalidations sent before the fork never reach the child.
+            CACHE.clear()
+            CACHE_PID = os.getpid()
+            events.add_listener(datastore.INVALIDATE_CHANNEL, on_invalidate)
+    return CACHE
+
+
+def on_invalidate(event):
+    CACHE.invalidate(event['type'], event['names'])
+
+
+def get_controller(c_name):
+    return get_cache().get(('controller', c_name), lambda: datastore.get_controller(c_name))
+
+
+def get_user(user):
+    return get_cache().get(('user', user), lambda: datastore.get_user(user))
+
+
+def controller_access(user, c_name):
+    for controller in (user or {}).get('controllers', []):
+        if controller['name'] == c_name:
+            return controller['access']
+
+
+def model_access(user, c_name, m_name):
+    for controller in (user or {}).get('controllers', []):
+        if controller['name'] == c_name:
+            for mod in controller['models']:
+                if mod['name'] == m_name:
+                    return mod['access']
+
+
+def get_model(controller, m_name):
+    for mod in controller['models']:
+        if mod['name'] == m_name:
+            return mod
+
+
+def get_etag(version):
+    return ETAGS.lookup(version)
+
+
+def set_etag(version, etag):
+    ETAGS.store(version, etag)
+
+
+def get_stats():
+    return dict(CACHE.get_stats(), etags=ETAGS.get_stats())
+
+
+datastore.INVALIDATION_HOOKS.append(CACHE.invalidate)
@@ -0,0 +1,221 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+import asyncio
+import hashlib
+import time
+from sojobo_api import settings
+from sojobo_api.api import w_state as state_cache
+################################################################################
+# CONNECTION POOL
+################################################################################
+# Logged in controller and model connections are kept open between requests and
+# handed out again to the next caller with the same endpoint, model and user.
+# Websockets belong to the event loop they were opened on, so every loop gets
+# its own pool. A model connection runs the AllWatcher of libjuju for as long as
+# it is open, so its state history is trimmed whenever it is released and no
+# connection is handed out again once it is older than max_age.
+POOLS = {}
+
+
+class JujuConnectionPool(object):
+    # A slot of the per-controller semaphore is held by every connection that is
+    # checked out, and is given back as soon as the connection is released, so a
+    # caller waiting for a slot is woken up by the next release. Idle connections
+    # hold no slot; they are counted in self.open and the oldest one of the
+    # controller is closed when a new connection would go over the limit.
+    def __init__(self, max_per_controller, idle_timeout, max_age, retries, backoff):
+        self.max_per_controller = max_per_controller
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.retries = retries
+        self.backoff = backoff
+        self.idle = {}
+        self.slots = {}
+        self.open = {}
+        self.created = {}
+        self.reaper = None
+        self.stats = {'hits': 0, 'misses': 0, 'reconnects': 0, 'evicted': 0, 'unhealthy': 0, 'expired': 0}
+
+    def slot(self, endpoint):
+        if endpoint not in self.slots:
+            self.slots[endpoint] = asyncio.Semaphore(self.max_per_controller)
+        return self.slots[endpoint]
+
+    async def acquire(self, key, factory):
+        await self.evict_idle()
+        slot = self.slot(key[0])
+        await slot.acquire()
+        try:
+            connection = await self.take_idle(key)
+            if connection is not None:
+                self.stats['hits'] += 1
+                return connection
+            self.stats['misses'] += 1
+            if self.open.get(key[0], 0) >= self.max_per_controller:
+                await self.evict_endpoint(key[0])
+            connection = await self.connect(factory)
+            self.open[key[0]] = self.open.get(key[0], 0) + 1
+            self.created[id(connection)] = time.monotonic()
+            return connection
+        except Exception:
+            slot.release()
+            raise
+
+    async def release(self, key, connection):
+        try:
+            if not is_open(connection):
+                self.stats['unhealthy'] += 1
+                await self.close(key, connection)
+            elif time.monotonic() - self.created.get(id(connection), 0) > self.max_age:
+                self.stats['expired'] += 1
+                await self.close(key, connection)
+            else:
+                trim_state(connection)
+                self.idle.setdefault(key, []).append((connection, time.monotonic()))
+        finally:
+            self.slot(key[0]).release()
+
+    async def connect(self, factory):
+        delay = self.backoff
+        for _ in range(self.retries):
+            try:
+                return await factory()
+            except (OSError, asyncio.TimeoutError):
+                self.stats['reconnects'] += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+        return await factory()
+
+    async def take_idle(self, key):
+        entries = self.idle.get(key, [])
+        while entries:
+            connection, _ = entries.pop()
+            if is_open(connection):
+                return connection
+            self.stats['unhealthy'] += 1
+            await self.close(key, connection)
+
+    async def close(self, key, connection):
+        self.open[key[0]] = self.open.get(key[0], 1) - 1
+        self.created.pop(id(connection), None)
+        try:
+            await connection.disconnect()
+        except Exception:  #pylint: disable=W0703
+            pass
+
+    async def evict(self, match):
+        for key in list(self.idle):
+            keep = []
+            for connection, released in self.idle[key]:
+                if match(key, released):
+                    self.stats['evicted'] += 1
+                    await self.close(key, connection)
+                else:
+                    keep.append((connection, released))
+            self.idle[key] = keep
+
+    async def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        await self.evict(lambda key, released: released < deadline)
+
+    async def evict_endpoint(self, endpoint):
+        # The controller is at its limit: make room by closing the connection of
+        # that controller which has been idle for the longest time.
+        entries = [(released, key) for key in self.idle for _, released in self.idle[key] if key[0] == endpoint]
+        if entries:
+            oldest, oldest_key = min(entries)
+            await self.evict(lambda key, released: key == oldest_key and released == oldest)
+
+    async def evict_user(self, username):
+        await self.evict(lambda key, released: key[2] == username)
+
+    async def reap(self):
+        # Idle connections are closed on a timer as well, so a process that
+        # gets no more requests does not keep them open.
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 2))
+            await self.evict_idle()
+
+    def start_reaper(self):
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.ensure_future(self.reap())
+
+    async def close_all(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            self.reaper = None
+        await self.evict(lambda key, released: True)
+
+    def get_stats(self):
+        endpoints = {}
+        for endpoint, slot in self.slots.items():
+            idle = sum(len(e) for k, e in self.idle.items() if k[0] == endpoint)
+            used = self.max_per_controller - slot._value  #pylint: disable=W0212
+            endpoints[endpoint] = {'open': self.open.get(endpoint, 0), 'idle': idle, 'in-use': used}
+        return dict(self.stats, endpoints=endpoints, **{'max-per-controller': self.max_per_controller})
+
+
+def trim_state(connection):
+    # Controller connections have no model state.
+    state = getattr(getattr(connection, 'state', None), 'state', None)
+    if state:
+        for entity in list(state):
+            for entity_id in list(state[entity]):
+                state_cache.trim_history(state, entity, entity_id)
+
+
+def is_open(connection):
+    return connection.connection is not None and connection.connection.is_open
+
+
+def connection_key(endpoint, uuid, username, password):
+    # The password is part of the key so a changed password never reuses a
+    # connection that was logged in with the old one.
+    return endpoint, uuid, username, hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def get_pool():
+    loop = asyncio.get_event_loop()
+    if loop not in POOLS:
+        POOLS[loop] = JujuConnectionPool(int(settings.JUJU_POOL_MAX_PER_CONTROLLER),
+                                         float(settings.JUJU_POOL_IDLE_TIMEOUT),
+                                         float(settings.JUJU_POOL_MAX_AGE),
+                                         int(settings.JUJU_POOL_CONNECT_RETRIES),
+                                         float(settings.JUJU_POOL_BACKOFF))
+    return POOLS[loop]
+
+
+async def acquire(key, factory):
+    pool = get_pool()
+    pool.start_reaper()
+    return await pool.acquire(key, factory)
+
+
+async def release(key, connection):
+    await get_pool().release(key, connection)
+
+
+async def evict_user(username):
+    await get_pool().evict_user(username)
+
+
+async def close_all():
+    await get_pool().close_all()
+
+
+def get_stats():
+    return [pool.get_stats() for pool in POOLS.values()]
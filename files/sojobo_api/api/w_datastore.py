@@ -1,92 +1,561 @@
 # pylint: disable=c0111,c0301, E0611, E0401
 #!/usr/bin/env python3.6
-import json
+from itertools import islice
+import hashlib
+import hmac
+import os
 import redis
 from sojobo_api import settings
+from sojobo_api.api import w_json as serializer
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 ################################################################################
 # Database Fucntions
 ################################################################################
+CONTROLLER_DB = 10
+USER_DB = 11
+JOB_DB = 12
+# Names can not start with an underscore, so these never collide with a document.
+CONTROLLER_INDEX = '_index:controllers'
+USER_INDEX = '_index:users'
+SCHEMA_KEY = '_schema'
+SCHEMA_VERSION = '2'
+STATS_KEY = '_stats:conflicts'
+AUTH_SALT_KEY = '_auth:salt'
+INVALIDATE_CHANNEL = '_events:invalidate'
+REVISIONS_KEY = '_revisions'
+INVALIDATION_HOOKS = []
+MIGRATED = set()
+CONFLICTS = {}
+AUTH_SALT = {}
+POOLS = {}
+POOLS_PID = None
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.checkouts = 0
+        self.checkout_errors = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            self.checkout_errors += 1
+            raise
+        self.checkouts += 1
+        return connection
+
+
+def get_pool(db):
+    global POOLS_PID  #pylint: disable=W0603
+    # Passenger forks its workers from a preloaded process, sockets of the parent
+    # must never be reused (or closed) by a child, so every pid gets its own pools.
+    if POOLS_PID != os.getpid():
+        POOLS.clear()
+        POOLS_PID = os.getpid()
+    if db not in POOLS:
+        POOLS[db] = MeteredConnectionPool(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=db,
+            encoding="utf-8",
+            decode_responses=True,
+            # Binary MessagePack values survive the decoding unchanged.
+            encoding_errors='surrogateescape',
+            max_connections=int(settings.REDIS_POOL_SIZE),
+            timeout=float(settings.REDIS_POOL_TIMEOUT),
+            socket_timeout=float(settings.REDIS_SOCKET_TIMEOUT),
+            socket_connect_timeout=float(settings.REDIS_CONNECT_TIMEOUT)
+        )
+    return POOLS[db]
+
+
 def connect_to_controllers():
-    return redis.StrictRedis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        charset="utf-8",
-        decode_responses=True,
-        db=10
-    )
+    return redis.StrictRedis(connection_pool=get_pool(CONTROLLER_DB))
 
 
 def connect_to_users():
-    return redis.StrictRedis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        charset="utf-8",
-        decode_responses=True,
-        db=11
-    )
+    return redis.StrictRedis(connection_pool=get_pool(USER_DB))
+
+
+def connect_to_jobs():
+    return redis.StrictRedis(connection_pool=get_pool(JOB_DB))
+
+
+def get_pool_stats():
+    result = {}
+    for name, db in [('controllers', CONTROLLER_DB), ('users', USER_DB), ('jobs', JOB_DB)]:
+        pool = get_pool(db)
+        created = len(pool._connections)  #pylint: disable=W0212
+        idle = len([c for c in pool.pool.queue if c is not None])
+        result[name] = {'db': db,
+                        'pid': os.getpid(),
+                        'max-connections': pool.max_connections,
+                        'created': created,
+                        'in-use': created - idle,
+                        'idle': idle,
+                        'saturation': round((created - idle) / pool.max_connections, 2),
+                        'checkouts': pool.checkouts,
+                        'checkout-errors': pool.checkout_errors}
+    return result
+
+
+class DatastoreConflict(Exception):
+    pass
+
+
+def transaction(con, func, *watches):
+    # func reads through the pipe while the watched keys are guarded, then calls
+    # pipe.multi() and queues its writes. When another client changes a watched
+    # key before EXEC, nothing is written and func runs again on fresh data.
+    for _ in range(int(settings.REDIS_TX_RETRIES)):
+        with con.pipeline() as pipe:
+            try:
+                pipe.watch(*watches)
+                result = func(pipe)
+                pipe.execute()
+                return result
+            except redis.WatchError:
+                record_conflict(con, watches[0], 'retries')
+    record_conflict(con, watches[0], 'failures')
+    raise DatastoreConflict('Gave up updating {} after {} conflicting writes'.format(
+        ', '.join(watches), settings.REDIS_TX_RETRIES))
+
+
+def record_conflict(con, key, kind):
+    field = '{}:{}'.format(key.split(':')[0].lstrip('_') if ':' in key else 'legacy', kind)
+    CONFLICTS[field] = CONFLICTS.get(field, 0) + 1
+    con.hincrby(STATS_KEY, field, 1)
+
+
+def get_conflict_stats():
+    total = {}
+    for con in [connect_to_controllers(), connect_to_users()]:
+        for field, count in con.hgetall(STATS_KEY).items():
+            total[field] = total.get(field, 0) + int(count)
+    return {'process': dict(CONFLICTS), 'total': total}
+
+
+def invalidate(kind, *names):
+    # Every write bumps the revision of the documents it changed, which the
+    # ETags of the API are derived from. Cached copies are dropped in this
+    # process right away and in all other processes once they get the
+    # published message.
+    names = [n for n in names if n]
+    if not names:
+        return
+    for hook in INVALIDATION_HOOKS:
+        hook(kind, names)
+    pipe = connect_to_jobs().pipeline(transaction=False)
+    for name in names:
+        pipe.hincrby(REVISIONS_KEY, revision_field(kind, name), 1)
+    pipe.publish(INVALIDATE_CHANNEL, serializer.dumps({'type': kind, 'names': names}))
+    pipe.execute()
+
+
+def revision_field(kind, name):
+    return '{}:{}'.format(kind, name)
+
+
+def get_revisions(*documents):
+    # The revisions of (kind, name) documents, 0 for one never written to.
+    revisions = connect_to_jobs().hmget(REVISIONS_KEY, [revision_field(k, n) for k, n in documents])
+    return [int(r or 0) for r in revisions]
+
+
+def model_ref(c_name, m_name):
+    return '{}:{}'.format(c_name, m_name)
+
+
+def rebuild_indexes(batch_size=500):
+    return {'users': rebuild_index(connect_to_users(), USER_INDEX, user_from_key, batch_size),
+            'controllers': rebuild_index(connect_to_controllers(), CONTROLLER_INDEX, controller_from_key, batch_size),
+            'controller-users': rebuild_controller_users(batch_size)}
+
+
+def rebuild_controller_users(batch_size):
+    # user:<user>:controllers is the source of truth, controller:<c>:users is its
+    # reverse index and only gets the entries it is missing.
+    con, c_con = connect_to_users(), connect_to_controllers()
+    added = 0
+    for key in con.scan_iter(match=user_controllers_key('*'), count=batch_size):
+        user = key[len('user:'):-len(':controllers')]
+        controllers = con.hgetall(key)
+        pipe = c_con.pipeline()
+        for c_name, access in controllers.items():
+            pipe.hsetnx(controller_users_key(c_name), user, access)
+        added += sum(pipe.execute())
+    return {'added': added}
+
+
+def rebuild_index(con, index, from_key, batch_size):
+    # SCAN walks the keyspace in small steps, so Redis keeps serving other clients
+    # while an existing database is (re)indexed.
+    found = set()
+    for key in con.scan_iter(count=batch_size):
+        name = from_key(key)
+        if name:
+            found.add(name)
+    members = set(con.sscan_iter(index, count=batch_size))
+    missing, stale = list(found - members), list(members - found)
+    pipe = con.pipeline()
+    for i in range(0, len(missing), batch_size):
+        pipe.sadd(index, *missing[i:i + batch_size])
+    for i in range(0, len(stale), batch_size):
+        pipe.srem(index, *stale[i:i + batch_size])
+    pipe.execute()
+    return {'indexed': len(found), 'added': len(missing), 'removed': len(stale)}
+################################################################################
+# CODEC
+################################################################################
+# The structured fields of the documents (ssh keys, credentials and endpoints)
+# are written as JSON or MessagePack, as set by DATASTORE_CODEC. A MessagePack
+# value starts with a marker byte that no JSON text starts with, so values of
+# either codec are read whatever the setting, and reencode_values() converts the
+# existing ones. JSON has no marker, it stays readable for older versions.
+MSGPACK_MARKER = '\x01'
+
+
+def select_codec(name):
+    return 'msgpack' if name == 'msgpack' and msgpack is not None else 'json'
+
+
+CODEC = select_codec(settings.DATASTORE_CODEC)
+
+
+def encode_value(value):
+    if CODEC == 'msgpack':
+        return MSGPACK_MARKER.encode('utf-8') + msgpack.packb(value, use_bin_type=True)
+    return serializer.dumps(value)
+
+
+def decode_value(data):
+    if data.startswith(MSGPACK_MARKER):
+        if msgpack is None:
+            raise ValueError('A datastore value is encoded with MessagePack, which is not installed')
+        return msgpack.unpackb(data[1:].encode('utf-8', 'surrogateescape'), raw=False)
+    return serializer.loads(data)
+
+
+def value_codec(data):
+    return 'msgpack' if data.startswith(MSGPACK_MARKER) else 'json'
+
+
+def value_size(data):
+    return len(data.encode('utf-8', 'surrogateescape') if isinstance(data, str) else data)
+
+
+def reencode_values(batch_size=500):
+    # Every key is rewritten in its own transaction, so the API keeps running
+    # and a value changed meanwhile is read again. Values already in the
+    # current codec are skipped, an interrupted run can simply be restarted.
+    result = {}
+    for name, con, pattern, fields in [
+            ('users', connect_to_users(), user_key('*'), ['ssh-keys']),
+            ('controllers', connect_to_controllers(), controller_key('*'), ['endpoints'])]:
+        stats = {'codec': CODEC, 'checked': 0, 'reencoded': 0, 'bytes-before': 0, 'bytes-after': 0}
+        for key in con.scan_iter(match=pattern, count=batch_size):
+            if key.endswith(':credentials'):
+                reencode_key(con, key, None, stats)
+            elif user_from_key(key) if name == 'users' else controller_from_key(key):
+                reencode_key(con, key, fields, stats)
+        result[name] = stats
+    return result
+
+
+def reencode_key(con, key, fields, stats):
+    def reencode(pipe):
+        if fields is None:
+            values = pipe.hgetall(key)
+        else:
+            values = {f: v for f, v in zip(fields, pipe.hmget(key, fields)) if v is not None}
+        changed = {f: encode_value(decode_value(v)) for f, v in values.items() if value_codec(v) != CODEC}
+        pipe.multi()
+        if changed:
+            pipe.hmset(key, changed)
+        return values, changed
+    values, changed = transaction(con, reencode, key)
+    stats['checked'] += len(values)
+    stats['reencoded'] += len(changed)
+    stats['bytes-before'] += sum(value_size(v) for v in values.values())
+    stats['bytes-after'] += sum(value_size(changed.get(f, v)) for f, v in values.items())
+################################################################################
+# LAYOUT FUNCTIONS
+################################################################################
+# Users, controllers and models are stored as hashes, with one hash per
+# (controller, model) holding the access level of every user on that model:
+#   db 11: user:<user>, user:<user>:credentials, user:<user>:controllers,
+#          access:<controller>:<model>
+#   db 10: controller:<controller>, controller:<controller>:users,
+#          controller:<controller>:models, model:<controller>:<model>
+# Documents of the old layout (one JSON string per user or controller) are
+# still read until migrate_layout() has run, and are converted the first time
+# they are written to.
+def user_key(user):
+    return 'user:{}'.format(user)
+
+
+def credentials_key(user):
+    return 'user:{}:credentials'.format(user)
+
+
+def user_controllers_key(user):
+    return 'user:{}:controllers'.format(user)
+
+
+def access_key(c_name, m_name):
+    return 'access:{}:{}'.format(c_name, m_name)
+
+
+def controller_key(c_name):
+    return 'controller:{}'.format(c_name)
+
+
+def controller_users_key(c_name):
+    return 'controller:{}:users'.format(c_name)
+
+
+def controller_models_key(c_name):
+    return 'controller:{}:models'.format(c_name)
+
+
+def model_key(c_name, m_name):
+    return 'model:{}:{}'.format(c_name, m_name)
+
+
+def user_from_key(key):
+    if key.startswith('user:'):
+        name = key[len('user:'):]
+        return None if ':' in name else name
+    if ':' not in key and not key.startswith('_'):
+        return key
+
+
+def controller_from_key(key):
+    if key.startswith('controller:'):
+        name = key[len('controller:'):]
+        return None if name.endswith((':users', ':models')) else name
+    if not key.startswith(('_', 'model:')):
+        return key
+
+
+def layout_migrated(con):
+    db = con.connection_pool.connection_kwargs['db']
+    if db not in MIGRATED and con.get(SCHEMA_KEY) == SCHEMA_VERSION:
+        MIGRATED.add(db)
+    return db in MIGRATED
+
+
+def get_legacy(con, key):
+    if layout_migrated(con):
+        return {}
+    data = con.get(key)
+    return serializer.loads(data) if data else {}
+
+
+def upgrade_user(con, user):
+    def upgrade(pipe):
+        data = pipe.get(user)
+        if data:
+            data = serializer.loads(data)
+            pipe.multi()
+            pipe.hmset(user_key(user), {'name': user, 'state': data['state'],
+                                        'ssh-keys': encode_value(data['ssh-keys'])})
+            for cred in data['credentials']:
+                pipe.hset(credentials_key(user), cred['name'], encode_value(cred))
+            for controller in data['controllers']:
+                pipe.hset(user_controllers_key(user), controller['name'], controller['access'])
+                for mod in controller['models']:
+                    pipe.hset(access_key(controller['name'], mod['name']), user, mod['access'])
+            pipe.delete(user)
+    if not layout_migrated(con):
+        transaction(con, upgrade, user)
+
+
+def upgrade_controller(con, c_name):
+    def upgrade(pipe):
+        data = pipe.get(c_name)
+        if data:
+            data = serializer.loads(data)
+            pipe.multi()
+            pipe.hmset(controller_key(c_name), controller_fields(data))
+            for usr in data['users']:
+                pipe.hset(controller_users_key(c_name), usr['name'], usr['access'])
+            for mod in data['models']:
+                pipe.sadd(controller_models_key(c_name), mod['name'])
+                pipe.hmset(model_key(c_name, mod['name']), model_fields(mod))
+            pipe.delete(c_name)
+    if not layout_migrated(con):
+        transaction(con, upgrade, c_name)
+
+
+def controller_fields(data):
+    fields = {k: v for k, v in data.items() if k not in ['users', 'models'] and v is not None}
+    fields['endpoints'] = encode_value(data.get('endpoints', []))
+    return fields
+
+
+def model_fields(data):
+    return {k: v for k, v in data.items() if v is not None}
+
+
+def user_document(data, credentials, controllers):
+    return {'name': data['name'],
+            'state': data['state'],
+            'ssh-keys': decode_value(data['ssh-keys']),
+            'credentials': [decode_value(credentials[c]) for c in sorted(credentials)],
+            'controllers': controllers}
+
+
+def controller_document(data, users, models):
+    data['endpoints'] = decode_value(data['endpoints'])
+    data['users'] = [{'name': u, 'access': users[u]} for u in sorted(users)]
+    data['models'] = models
+    return data
+
+
+def model_document(data):
+    data.setdefault('credential', None)
+    return data
+
+
+def migrate_layout(batch_size=500):
+    result = {}
+    for name, con, from_key, upgrade in [('users', connect_to_users(), user_from_key, upgrade_user),
+                                         ('controllers', connect_to_controllers(), controller_from_key, upgrade_controller)]:
+        legacy = [k for k in con.scan_iter(count=batch_size) if from_key(k) == k and con.type(k) == 'string']
+        for key in legacy:
+            upgrade(con, key)
+        con.set(SCHEMA_KEY, SCHEMA_VERSION)
+        result[name] = {'migrated': len(legacy)}
+    for name, res in rebuild_indexes(batch_size).items():
+        result.setdefault(name, {}).update(res)
+    return result
 ################################################################################
 # USER FUNCTIONS
 ################################################################################
 def create_user(user_name):
-    if not user_name in get_all_users():
-        user = {'name' : user_name,
-                'controllers': [],
-                'ssh-keys': [],
-                'credentials': [],
-                'state': 'pending'}
-        con = connect_to_users()
-        con.set(user_name, json.dumps(user))
+    def create(pipe):
+        if not pipe.sismember(USER_INDEX, user_name):
+            pipe.multi()
+            pipe.sadd(USER_INDEX, user_name)
+            pipe.hmset(user_key(user_name), {'name' : user_name,
+                                             'ssh-keys': encode_value([]),
+                                             'state': 'pending'})
+    transaction(connect_to_users(), create, USER_INDEX)
+    invalidate('user', user_name)
 
 
 def get_user(user):
+    return get_users([user])[0]
+
+
+def get_users(users, with_controllers=True):
+    # Three pipelined round trips, however many users are asked for. Without
+    # controllers only the first one is needed.
     con = connect_to_users()
-    return json.loads(con.get(user))
+    pipe = con.pipeline(transaction=False)
+    for user in users:
+        pipe.hgetall(user_key(user))
+        pipe.hgetall(credentials_key(user))
+        pipe.hgetall(user_controllers_key(user))
+    res = pipe.execute()
+    rows = [res[i:i + 3] for i in range(0, len(res), 3)]
+    if not with_controllers:
+        rows = [(data, credentials, {}) for data, credentials, _ in rows]
+    c_names = sorted({c for data, _, controllers in rows if data for c in controllers})
+    pipe = connect_to_controllers().pipeline(transaction=False)
+    for c_name in c_names:
+        pipe.hget(controller_key(c_name), 'type')
+        pipe.smembers(controller_models_key(c_name))
+    res = pipe.execute()
+    c_types = dict(zip(c_names, res[0::2]))
+    c_models = dict(zip(c_names, [sorted(m) for m in res[1::2]]))
+    pipe = con.pipeline(transaction=False)
+    for user, (data, _, controllers) in zip(users, rows):
+        if data:
+            for c_name in sorted(controllers):
+                for m_name in c_models[c_name]:
+                    pipe.hget(access_key(c_name, m_name), user)
+    access = iter(pipe.execute())
+    result = []
+    for user, (data, credentials, controllers) in zip(users, rows):
+        if not data:
+            result.append(get_legacy(con, user) or None)
+            continue
+        u_controllers = []
+        for c_name in sorted(controllers):
+            models = c_models[c_name]
+            m_access = [{'name': m, 'access': a} for m, a in zip(models, islice(access, len(models))) if a is not None]
+            u_controllers.append({'name': c_name, 'access': controllers[c_name], 'type': c_types[c_name], 'models': m_access})
+        result.append(user_document(data, credentials, u_controllers))
+    return result
+
+
+def get_user_states(users):
+    con = connect_to_users()
+    pipe = con.pipeline(transaction=False)
+    for user in users:
+        pipe.hget(user_key(user), 'state')
+    result = {}
+    for user, state in zip(users, pipe.execute()):
+        result[user] = state if state is not None else get_legacy(con, user).get('state')
+    return result
 
 
 def set_user_state(user_name, state):
     con = connect_to_users()
-    data = json.loads(con.get(user_name))
-    data['state'] = state
-    con.set(user_name, json.dumps(data))
+    upgrade_user(con, user_name)
+    con.hset(user_key(user_name), 'state', state)
+    invalidate('user', user_name)
 
 
 def get_user_state(username):
-    data = get_user(username)
-    return data['state']
+    con = connect_to_users()
+    state = con.hget(user_key(username), 'state')
+    return state if state is not None else get_legacy(con, username)['state']
 
 
 def update_ssh_keys(user, ssh_keys):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    data['ssh-keys'] = ssh_keys
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    con.hset(user_key(user), 'ssh-keys', encode_value(ssh_keys))
+    invalidate('user', user)
 
 
 def get_ssh_keys(user):
     con = connect_to_users()
-    return json.loads(con.get(user))['ssh-keys']
+    keys = con.hget(user_key(user), 'ssh-keys')
+    return decode_value(keys) if keys is not None else get_legacy(con, user)['ssh-keys']
 
 
 def add_credential(user, cred):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    if cred not in data['credentials']:
-        data['credentials'].append(cred)
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    con.hset(credentials_key(user), cred['name'], encode_value(cred))
+    invalidate('user', user)
 
 
 def remove_credential(user, cred_name):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for cred in data['credentials']:
-        if cred_name == cred['name']:
-            data['credentials'].remove(cred)
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    con.hdel(credentials_key(user), cred_name)
+    invalidate('user', user)
 
 
 def get_credentials(user):
     con = connect_to_users()
-    return json.loads(con.get(user))['credentials']
+    pipe = con.pipeline(transaction=False)
+    pipe.exists(user_key(user))
+    pipe.hgetall(credentials_key(user))
+    exists, credentials = pipe.execute()
+    if not exists:
+        return get_legacy(con, user)['credentials']
+    return [decode_value(credentials[c]) for c in sorted(credentials)]
 
 
 def get_credential_keys(user):
@@ -95,269 +564,446 @@ def get_credential_keys(user):
 
 def get_all_users():
     con = connect_to_users()
-    return con.keys()
+    return sorted(con.smembers(USER_INDEX))
+
+
+def auth_key(user):
+    return '_auth:{}'.format(user)
+
+
+def auth_generation_key(user):
+    return '_auth:{}:generation'.format(user)
+
+
+def credentials_digest(con, user, password):
+    # Only a salted digest of verified credentials is stored, the salt is shared
+    # by every worker so a login verified by one of them counts for all.
+    if 'salt' not in AUTH_SALT:
+        con.set(AUTH_SALT_KEY, os.urandom(32).hex(), nx=True)
+        AUTH_SALT['salt'] = con.get(AUTH_SALT_KEY)
+    msg = '{}\0{}'.format(user, password).encode('utf-8')
+    return hmac.new(AUTH_SALT['salt'].encode('utf-8'), msg, hashlib.sha256).hexdigest()
+
+
+def credentials_generation(user):
+    # Read before the credentials are verified and passed to cache_credentials,
+    # so a login that raced with a revocation is never cached.
+    return connect_to_users().get(auth_generation_key(user)) or '0'
+
+
+def cache_credentials(user, password, generation):
+    if int(settings.AUTH_CACHE_TTL) > 0:
+        con = connect_to_users()
+        digest = credentials_digest(con, user, password)
+        def store(pipe):
+            current = pipe.get(auth_generation_key(user)) or '0'
+            pipe.multi()
+            if current == generation:
+                pipe.setex(auth_key(user), int(settings.AUTH_CACHE_TTL), digest)
+        transaction(con, store, auth_generation_key(user))
+
+
+def credentials_cached(user, password):
+    if int(settings.AUTH_CACHE_TTL) <= 0:
+        return False
+    con = connect_to_users()
+    cached = con.get(auth_key(user))
+    return cached is not None and hmac.compare_digest(cached, credentials_digest(con, user, password))
+
+
+def revoke_credentials(user):
+    con = connect_to_users()
+    pipe = con.pipeline()
+    pipe.incr(auth_generation_key(user))
+    pipe.delete(auth_key(user))
+    pipe.execute()
+
+
+def user_exists(user_name):
+    con = connect_to_users()
+    return con.sismember(USER_INDEX, user_name)
 ################################################################################
 # CONTROLLER FUNCTIONS
 ################################################################################
 def create_controller(controller_name, c_type, region, cred_name):
-    con = connect_to_controllers()
-    if controller_name in con.keys():
-        return False
-    else:
+    def create(pipe):
+        if pipe.sismember(CONTROLLER_INDEX, controller_name):
+            return False
         controller = {
             'name' : controller_name,
             'state': 'accepted',
-            'users': [],
             'type' : c_type,
-            'models' : [],
             'endpoints': [],
             'uuid': '',
             'ca-cert': '',
             'region': region,
             'default-credential' : cred_name
         }
-        con.set(controller_name, json.dumps(controller))
+        pipe.multi()
+        pipe.sadd(CONTROLLER_INDEX, controller_name)
+        pipe.hmset(controller_key(controller_name), controller_fields(controller))
         return True
+    created = transaction(connect_to_controllers(), create, CONTROLLER_INDEX)
+    invalidate('controller', controller_name)
+    return created
 
 def get_cloud_controllers(c_type):
     con = connect_to_controllers()
-    cons = con.keys()
+    c_names = get_all_controllers()
+    pipe = con.pipeline(transaction=False)
+    for c_name in c_names:
+        pipe.hget(controller_key(c_name), 'type')
     result = []
-    for c_name in cons:
-        data = json.loads(con.get(c_name))
-        if data['type'] == c_type:
+    for c_name, con_type in zip(c_names, pipe.execute()):
+        if con_type is None:
+            con_type = get_legacy(con, c_name).get('type')
+        if con_type == c_type:
             result.append(c_name)
     return result
 
 
 def add_user_to_controller(c_name, user, access):
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    c_type = data['type']
-    exists = False
-    for usr in data['users']:
-        if usr['name'] == user:
-            exists = True
-            usr['name']['access'] = access
-            break
-    if not exists:
-        data['users'].append({'name': user, 'access': access})
-    con.set(c_name, json.dumps(data))
+    upgrade_controller(con, c_name)
+    con.hset(controller_users_key(c_name), user, access)
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            controller['access'] = access
-            exists = True
-            break
-    if not exists:
-        data['controllers'].append({
-            'access' : access,
-            'name': c_name,
-            'models' : [],
-            'type': c_type
-        })
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    con.hset(user_controllers_key(user), c_name, access)
+    invalidate('controller', c_name)
+    invalidate('user', user)
 
 
 def set_controller_state(controller, state, endpoints=None, uuid=None, ca_cert=None):
     con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    data['state'] = state
+    upgrade_controller(con, controller)
+    fields = {'state': state}
     if endpoints:
-        data['endpoints'] = endpoints
+        fields['endpoints'] = encode_value(endpoints)
     if uuid:
-        data['uuid'] = uuid
+        fields['uuid'] = uuid
     if ca_cert:
-        data['ca-cert'] = ca_cert
-    con.set(controller, json.dumps(data))
+        fields['ca-cert'] = ca_cert
+    con.hmset(controller_key(controller), fields)
+    invalidate('controller', controller)
 
 
 def destroy_controller(c_name):
     con = connect_to_controllers()
-    con.delete(c_name)
-    for user in get_all_users():
-        remove_controller(c_name, user)
+    upgrade_controller(con, c_name)
+    pipe = con.pipeline(transaction=False)
+    pipe.hkeys(controller_users_key(c_name))
+    pipe.smembers(controller_models_key(c_name))
+    users, models = pipe.execute()
+    u_con = connect_to_users()
+    if not layout_migrated(u_con):
+        for user in users:
+            upgrade_user(u_con, user)
+    pipe = u_con.pipeline()
+    for user in users:
+        pipe.hdel(user_controllers_key(user), c_name)
+    if models:
+        pipe.delete(*[access_key(c_name, m) for m in models])
+    pipe.execute()
+    pipe = con.pipeline()
+    pipe.delete(controller_key(c_name), controller_users_key(c_name), controller_models_key(c_name),
+                *[model_key(c_name, m) for m in models])
+    pipe.srem(CONTROLLER_INDEX, c_name)
+    pipe.execute()
+    invalidate('controller', c_name)
+    invalidate('user', *users)
+    invalidate('access', *[model_ref(c_name, m) for m in models])
 
 
 def remove_controller(c_name, user):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            data['controllers'].remove(controller)
-            break
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    models = get_model_names(c_name)
+    pipe = con.pipeline()
+    pipe.hdel(user_controllers_key(user), c_name)
+    for m_name in models:
+        pipe.hdel(access_key(c_name, m_name), user)
+    pipe.execute()
+    invalidate('user', user)
+    invalidate('access', *[model_ref(c_name, m) for m in models])
 
 
 def get_controller(c_name):
+    return get_controllers([c_name])[0]
+
+
+def get_controllers(c_names, with_models=True):
+    # Two pipelined round trips, however many controllers are asked for.
+    # Without models only the first one is needed.
+    con = connect_to_controllers()
+    pipe = con.pipeline(transaction=False)
+    for c_name in c_names:
+        pipe.hgetall(controller_key(c_name))
+        pipe.hgetall(controller_users_key(c_name))
+        pipe.smembers(controller_models_key(c_name))
+    res = pipe.execute()
+    rows = [res[i:i + 3] for i in range(0, len(res), 3)]
+    if not with_models:
+        rows = [(data, users, set()) for data, users, _ in rows]
+    pipe = con.pipeline(transaction=False)
+    for c_name, (data, _, models) in zip(c_names, rows):
+        if data:
+            for m_name in sorted(models):
+                pipe.hgetall(model_key(c_name, m_name))
+    model_data = iter(pipe.execute())
+    result = []
+    for c_name, (data, users, models) in zip(c_names, rows):
+        if not data:
+            result.append(get_legacy(con, c_name) or None)
+        else:
+            models = [model_document(m) for m in islice(model_data, len(models)) if m]
+            result.append(controller_document(data, users, models))
+    return result
+
+
+def get_controller_states(c_names=None):
+    con = connect_to_controllers()
+    c_names = get_all_controllers() if c_names is None else c_names
+    pipe = con.pipeline(transaction=False)
+    for c_name in c_names:
+        pipe.hget(controller_key(c_name), 'state')
+    result = {}
+    for c_name, state in zip(c_names, pipe.execute()):
+        result[c_name] = state if state is not None else get_legacy(con, c_name).get('state')
+    return result
+
+
+def get_models(con, c_name, models):
+    pipe = con.pipeline(transaction=False)
+    for m_name in sorted(models):
+        pipe.hgetall(model_key(c_name, m_name))
+    return [model_document(m) for m in pipe.execute() if m]
+
+
+def get_model_names(c_name):
     con = connect_to_controllers()
-    return json.loads(con.get(c_name))
+    models = con.smembers(controller_models_key(c_name))
+    if not models:
+        return [m['name'] for m in get_legacy(con, c_name).get('models', [])]
+    return sorted(models)
 
 
 def add_model_to_controller(c_name, m_name):
+    def add(pipe):
+        if not pipe.sismember(controller_models_key(c_name), m_name):
+            pipe.multi()
+            pipe.sadd(controller_models_key(c_name), m_name)
+            pipe.hmset(model_key(c_name, m_name), {'name': m_name, 'state': 'Model is being deployed', 'uuid': ''})
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    exists = False
-    for model in data['models']:
-        if model['name'] == m_name:
-            exists = True
-            break
-    if not exists:
-        data['models'].append({'name': m_name, 'state': 'Model is being deployed', 'uuid': ''})
-    con.set(c_name, json.dumps(data))
+    upgrade_controller(con, c_name)
+    transaction(con, add, controller_models_key(c_name))
+    invalidate('controller', c_name)
 
 
 def set_model_state(c_name, m_name, state, credential=None, uuid=None):
-    con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    for model in data['models']:
-        if model['name'] == m_name:
-            model['state'] = state
-            model['credential'] = credential
+    def set_state(pipe):
+        if pipe.sismember(controller_models_key(c_name), m_name):
+            pipe.multi()
+            pipe.hset(model_key(c_name, m_name), 'state', state)
+            if credential is not None:
+                pipe.hset(model_key(c_name, m_name), 'credential', credential)
+            else:
+                pipe.hdel(model_key(c_name, m_name), 'credential')
             if uuid:
-                model['uuid'] = uuid
-            break
-    con.set(c_name, json.dumps(data))
+                pipe.hset(model_key(c_name, m_name), 'uuid', uuid)
+    con = connect_to_controllers()
+    upgrade_controller(con, c_name)
+    transaction(con, set_state, controller_models_key(c_name))
+    invalidate('controller', c_name)
 
 
 def check_model_state(c_name, m_name):
-    con = get_controller(c_name)
-    for mod in con['models']:
-        if mod['name'] == m_name:
-            return mod['state']
-    return 'error'
+    mod = get_model(c_name, m_name)
+    return mod['state'] if mod else 'error'
 
 
 def get_controller_access(c_name, user):
-    for controller in get_user(user)['controllers']:
+    con = connect_to_users()
+    if con.exists(user_key(user)):
+        return con.hget(user_controllers_key(user), c_name)
+    for controller in get_legacy(con, user).get('controllers', []):
         if controller['name'] == c_name:
             return controller['access']
 
 
 def set_controller_access(c_name, user, access):
+    def set_access(key, field):
+        def update(pipe):
+            if pipe.hexists(key, field):
+                pipe.multi()
+                pipe.hset(key, field, access)
+        return update
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            controller['access'] = access
-            break
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    transaction(con, set_access(user_controllers_key(user), c_name), user_controllers_key(user))
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    for usr in data['users']:
-        if usr['name'] == user:
-            usr['access'] = access
-            break
-    con.set(c_name, json.dumps(data))
+    upgrade_controller(con, c_name)
+    transaction(con, set_access(controller_users_key(c_name), user), controller_users_key(c_name))
+    invalidate('controller', c_name)
+    invalidate('user', user)
 
 
 def delete_user(user):
-    con = connect_to_controllers()
-    for c_name in con.keys():
-        data = json.loads(con.get(c_name))
-        if user in data['users']:
-            data['users'].remove(user)
-            con.set(c_name, json.dumps(data))
     con = connect_to_users()
-    con.delete(user)
+    upgrade_user(con, user)
+    controllers = con.hkeys(user_controllers_key(user))
+    c_con = connect_to_controllers()
+    for c_name in controllers:
+        upgrade_controller(c_con, c_name)
+        c_con.hdel(controller_users_key(c_name), user)
+    pipe = con.pipeline()
+    models = [(c_name, m_name) for c_name in controllers for m_name in get_model_names(c_name)]
+    for c_name, m_name in models:
+        pipe.hdel(access_key(c_name, m_name), user)
+    pipe.delete(user_key(user), credentials_key(user), user_controllers_key(user), auth_key(user))
+    pipe.srem(USER_INDEX, user)
+    pipe.execute()
+    invalidate('controller', *controllers)
+    invalidate('user', user)
+    invalidate('access', *[model_ref(c, m) for c, m in models])
 
 
 def get_controller_users(c_name):
-    data = get_controller(c_name)
-    return data['users']
+    con = connect_to_controllers()
+    pipe = con.pipeline(transaction=False)
+    pipe.exists(controller_key(c_name))
+    pipe.hgetall(controller_users_key(c_name))
+    exists, users = pipe.execute()
+    if not exists:
+        return get_legacy(con, c_name)['users']
+    return [{'name': u, 'access': users[u]} for u in sorted(users)]
 
 def get_default_credential(c_name):
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    return data['default-credential']
+    cred = con.hget(controller_key(c_name), 'default-credential')
+    return cred if cred is not None else get_legacy(con, c_name)['default-credential']
 
 def get_all_controllers():
     con = connect_to_controllers()
-    return con.keys()
+    return sorted(con.smembers(CONTROLLER_INDEX))
+
+
+def controller_exists(c_name):
+    con = connect_to_controllers()
+    return con.sismember(CONTROLLER_INDEX, c_name)
+
+
+def model_exists(c_name, m_name):
+    con = connect_to_controllers()
+    if con.sismember(controller_models_key(c_name), m_name):
+        return True
+    return any(m['name'] == m_name for m in get_legacy(con, c_name).get('models', []))
 
 
 def get_all_models(controller):
     con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    return data['models']
+    pipe = con.pipeline(transaction=False)
+    pipe.exists(controller_key(controller))
+    pipe.smembers(controller_models_key(controller))
+    exists, models = pipe.execute()
+    if not exists:
+        return get_legacy(con, controller)['models']
+    return get_models(con, controller, models)
 ################################################################################
 # MODEL FUNCTIONS
 ################################################################################
 def delete_model(controller, model):
     con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    for mod in data['models']:
-        if mod['name'] == model:
-            data['models'].remove(mod)
-            break
-    con.set(controller, json.dumps(data))
-    for user in get_all_users():
-        remove_model(controller, model, user)
+    upgrade_controller(con, controller)
+    pipe = con.pipeline()
+    pipe.srem(controller_models_key(controller), model)
+    pipe.delete(model_key(controller, model))
+    pipe.execute()
+    con = connect_to_users()
+    users = get_users_model(controller, model)
+    if not layout_migrated(con):
+        for user in users:
+            upgrade_user(con, user)
+    con.delete(access_key(controller, model))
+    invalidate('controller', controller)
+    invalidate('user', *users)
+    invalidate('access', model_ref(controller, model))
 
 
 def remove_model(controller, model, user):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for contr in data['controllers']:
-        if contr['name'] == controller:
-            for mod in contr['models']:
-                if mod['name'] == model:
-                    contr['models'].remove(mod)
-                    break
-            break
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    con.hdel(access_key(controller, model), user)
+    invalidate('user', user)
+    invalidate('access', model_ref(controller, model))
 
 
 def get_model_access(controller, model, user):
-    data = get_user(user)
-    for con in data['controllers']:
-        if con['name'] == controller:
-            for mod in con['models']:
+    con = connect_to_users()
+    access = con.hget(access_key(controller, model), user)
+    if access is not None:
+        return access
+    for contr in get_legacy(con, user).get('controllers', []):
+        if contr['name'] == controller:
+            for mod in contr['models']:
                 if mod['name'] == model:
                     return mod['access']
 
 
 def set_model_access(controller, model, user, access):
+    def set_access(pipe):
+        if pipe.hexists(user_controllers_key(user), controller):
+            pipe.multi()
+            pipe.hset(access_key(controller, model), user, access)
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    acces_set = False
-    for contr in data['controllers']:
-        if contr['name'] == controller:
-            for mod in contr['models']:
-                if model == mod['name']:
-                    mod['access'] = access
-                    acces_set = True
-    if not acces_set:
-        for contr in data['controllers']:
-            if contr['name'] == controller:
-                contr['models'].append({'name': model, 'access': access})
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    transaction(con, set_access, user_controllers_key(user))
+    invalidate('user', user)
+    invalidate('access', model_ref(controller, model))
 
 
 def get_models_access(controller, user):
-    data = get_user(user)
-    for con in data['controllers']:
-        if con['name'] == controller:
-            return con['models']
+    con = connect_to_users()
+    pipe = con.pipeline(transaction=False)
+    pipe.exists(user_key(user))
+    pipe.hexists(user_controllers_key(user), controller)
+    exists, has_controller = pipe.execute()
+    if not exists:
+        for contr in get_legacy(con, user).get('controllers', []):
+            if contr['name'] == controller:
+                return contr['models']
+    elif has_controller:
+        models = get_model_names(controller)
+        pipe = con.pipeline(transaction=False)
+        for m_name in models:
+            pipe.hget(access_key(controller, m_name), user)
+        return [{'name': m, 'access': a} for m, a in zip(models, pipe.execute()) if a is not None]
 
 
 def remove_models_access(controller, user):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for con in data['controllers']:
-        if con['name'] == controller:
-            con['models'] = []
-            break
-    con.set(user, json.dumps(data))
+    upgrade_user(con, user)
+    pipe = con.pipeline()
+    models = get_model_names(controller)
+    for m_name in models:
+        pipe.hdel(access_key(controller, m_name), user)
+    pipe.execute()
+    invalidate('user', user)
+    invalidate('access', *[model_ref(controller, m) for m in models])
 
 
 def get_model(controller, model):
-    data = get_controller(controller)
-    for mod in data['models']:
+    con = connect_to_controllers()
+    data = con.hgetall(model_key(controller, model))
+    if data:
+        return model_document(data)
+    for mod in get_legacy(con, controller).get('models', []):
         if mod['name'] == model:
             return mod
 
 
 def get_users_model(controller, model):
-    return [u for u in get_all_users() if get_model_access(controller, model, u) is not None]
+    con = connect_to_users()
+    users = set(con.hkeys(access_key(controller, model)))
+    if not layout_migrated(con):
+        users.update(u for u in get_all_users() if get_model_access(controller, model, u) is not None)
+    return sorted(users)
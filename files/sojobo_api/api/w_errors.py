@@ -74,3 +74,11 @@ def already_exists(item):
 
 def cmd_error(message):
     return 500, message
+
+
+def task_timeout(task):
+    return 504, 'The operation {} did not complete in time'.format(task)
+
+
+def queue_full():
+    return 503, 'Too many operations are waiting to be executed, try again later'
@@ -0,0 +1,175 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+import asyncio
+import logging
+import os
+import queue
+from threading import Lock, Thread, get_ident
+import time
+import redis
+from sojobo_api import settings
+from sojobo_api.api import w_datastore as datastore, w_state as state_cache, w_json as serializer
+################################################################################
+# PUBLISH / SUBSCRIBE
+################################################################################
+# Events between processes go through Redis pub/sub. Every process has one
+# listener thread on all event channels, which hands each message to the
+# callbacks registered for its channel.
+EVENTS_PATTERN = '_events:*'
+LISTENERS = {}
+LISTENER_PID = None
+LISTENER_LOCK = Lock()
+LOGGER = logging.getLogger('w_events')
+
+
+def job_channel(c_name, m_name):
+    return '_events:jobs:{}:{}'.format(c_name, m_name)
+
+
+def publish(channel, event):
+    datastore.connect_to_jobs().publish(channel, serializer.dumps(event))
+
+
+def add_listener(channel, callback):
+    start_listener()
+    with LISTENER_LOCK:
+        LISTENERS.setdefault(channel, set()).add(callback)
+
+
+def remove_listener(channel, callback):
+    with LISTENER_LOCK:
+        LISTENERS.get(channel, set()).discard(callback)
+        if not LISTENERS.get(channel, True):
+            del LISTENERS[channel]
+
+
+def start_listener():
+    global LISTENER_PID  #pylint: disable=W0603
+    with LISTENER_LOCK:
+        if LISTENER_PID != os.getpid():
+            LISTENERS.clear()
+            LISTENER_PID = os.getpid()
+            Thread(target=listen, name='redis-events', daemon=True).start()
+
+
+def listen():
+    while True:
+        try:
+            # A dedicated connection, pooled ones time out while waiting.
+            con = redis.StrictRedis(host=settings.REDIS_HOST, port=int(settings.REDIS_PORT),
+                                    decode_responses=True,
+                                    socket_connect_timeout=float(settings.REDIS_CONNECT_TIMEOUT))
+            pubsub = con.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(EVENTS_PATTERN)
+            for message in pubsub.listen():
+                with LISTENER_LOCK:
+                    callbacks = list(LISTENERS.get(message['channel'], ()))
+                if callbacks:
+                    dispatch(message, callbacks)
+        except redis.RedisError:
+            time.sleep(1)
+        except Exception:  #pylint: disable=W0703
+            # Cache invalidation, job events and plugin reloads all depend on
+            # this thread, nothing may stop it.
+            LOGGER.exception('Listening for events failed')
+            time.sleep(1)
+
+
+def dispatch(message, callbacks):
+    try:
+        event = serializer.loads(message['data'])
+    except Exception:  #pylint: disable=W0703
+        LOGGER.exception('Dropping malformed event on %s', message['channel'])
+        return
+    for callback in callbacks:
+        try:
+            callback(event)
+        except Exception:  #pylint: disable=W0703
+            LOGGER.exception('Event callback %r on %s failed', callback, message['channel'])
+################################################################################
+# MODEL EVENT FEED
+################################################################################
+class Subscription(object):
+    # A bounded buffer of events for one client. Subscriptions of the async
+    # server wait on an asyncio queue of its loop, all others on a thread-safe
+    # queue. A client that does not keep up loses events instead of memory.
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.thread = get_ident()
+        size = int(settings.EVENTS_QUEUE_SIZE)
+        self.events = asyncio.Queue(size) if loop else queue.Queue(size)
+        self.dropped = 0
+
+    def put(self, event):
+        if self.loop is not None and get_ident() != self.thread:
+            self.loop.call_soon_threadsafe(self.put_nowait, event)
+        else:
+            self.put_nowait(event)
+
+    def put_nowait(self, event):
+        try:
+            self.events.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            self.dropped += 1
+
+    def get(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def get_async(self, timeout):
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def drain(self):
+        result = []
+        while True:
+            try:
+                result.append(self.events.get_nowait())
+            except (queue.Empty, asyncio.QueueEmpty):
+                return result
+
+
+async def subscribe_model(c_name, model, subscription):
+    # One watcher per model fans out to every subscriber of that model.
+    await state_cache.subscribe(model.c_endpoint, model.m_uuid, model.c_cacert, subscription.put)
+    add_listener(job_channel(c_name, model.m_name), subscription.put)
+
+
+async def unsubscribe_model(c_name, model, subscription):
+    remove_listener(job_channel(c_name, model.m_name), subscription.put)
+    await state_cache.unsubscribe(model.m_uuid, subscription.put)
+
+
+def poll(subscription, timeout):
+    # A long-poll subscribes for the duration of one request only: events that
+    # happen between two polls are not delivered. Clients that need every
+    # event use the server-sent events stream, and re-read the model after a
+    # poll returns to catch up on what they may have missed.
+    first = subscription.get(timeout)
+    return [] if first is None else [first] + subscription.drain()
+
+
+def to_sse(event):
+    return 'event: {}\ndata: {}\n\n'.format(event['type'], serializer.dumps(event))
+
+
+def keepalive():
+    return ': keepalive\n\n'
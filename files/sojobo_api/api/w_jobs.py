@@ -0,0 +1,209 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+from datetime import datetime
+import json
+import time
+from uuid import uuid4
+from flask import abort, g, has_request_context, request
+from sojobo_api import settings
+from sojobo_api.api import w_errors as errors, w_datastore as datastore, w_events as events
+################################################################################
+# JOB QUEUE
+################################################################################
+# Background operations are queued in Redis and executed by the long running
+# worker in scripts/job_worker.py. A job names the script under scripts/ and the
+# function of that script to await, together with its arguments.
+#   job:<id>                  hash with the job document
+#   job:<id>:args             arguments of the job, expire after JOB_ARGS_TTL
+#   _queue:jobs               list of queued job ids
+#   _queue:processing:<w>     job ids taken by worker <w>, requeued if it dies
+#   _index:jobs               sorted set of the most recent job ids by creation
+# A job is queued, running, succeeded or failed. While it runs, every step the
+# script logs is recorded as its progress. Arguments can hold passwords, so they
+# are kept apart from the job document, never outlive JOB_ARGS_TTL and are
+# removed as soon as the job is done.
+QUEUE_KEY = '_queue:jobs'
+JOB_INDEX = '_index:jobs'
+SCRIPTS = ['add_controller', 'remove_controller', 'add_model', 'remove_machine', 'bundle_deployment',
+           'add_unit', 'add_user', 'delete_user', 'update_ssh_keys', 'add_credential', 'remove_credential',
+           'set_controller_access', 'set_model_access']
+
+
+def job_key(job_id):
+    return 'job:{}'.format(job_id)
+
+
+def args_key(job_id):
+    return 'job:{}:args'.format(job_id)
+
+
+def processing_key(worker):
+    return '_queue:processing:{}'.format(worker)
+
+
+def enqueue(script, function, *args):
+    con = datastore.connect_to_jobs()
+    if con.llen(QUEUE_KEY) >= int(settings.JOB_QUEUE_MAX):
+        error = errors.queue_full()
+        abort(error[0], error[1])
+    job_id = uuid4().hex
+    now = time.time()
+    job = {'id': job_id, 'script': script, 'function': function,
+           'state': 'queued', 'user': '', 'controller': '', 'model': '', 'created': now,
+           'attempts': 0, 'steps': 0}
+    if has_request_context():
+        # The 202 response of the request points to the job it queued.
+        g.setdefault('jobs', []).append(job_id)
+        if request.authorization:
+            job['user'] = request.authorization.username
+        # Jobs of a model show up in the event feed of that model.
+        job['controller'] = (request.view_args or {}).get('controller', '')
+        job['model'] = (request.view_args or {}).get('model', '')
+    pipe = con.pipeline()
+    pipe.hmset(job_key(job_id), job)
+    pipe.set(args_key(job_id), json.dumps(args), ex=int(settings.JOB_ARGS_TTL))
+    pipe.zadd(JOB_INDEX, {job_id: now})
+    pipe.zremrangebyrank(JOB_INDEX, 0, -int(settings.JOB_HISTORY) - 1)
+    pipe.lpush(QUEUE_KEY, job_id)
+    pipe.execute()
+    publish_job(job)
+    return job_id
+
+
+def claim(worker, timeout):
+    con = datastore.connect_to_jobs()
+    job_id = con.brpoplpush(QUEUE_KEY, processing_key(worker), timeout)
+    if job_id is None:
+        return None
+    pipe = con.pipeline()
+    pipe.hmset(job_key(job_id), {'state': 'running', 'started': time.time(), 'worker': worker})
+    pipe.hincrby(job_key(job_id), 'attempts', 1)
+    pipe.hgetall(job_key(job_id))
+    pipe.get(args_key(job_id))
+    job, args = pipe.execute()[-2:]
+    if args is None:
+        finish(worker, job_id, 'The arguments of this job expired before it could run')
+        return None
+    publish_job(job)
+    job['args'] = json.loads(args)
+    return job
+
+
+def progress(job_id, step):
+    con = datastore.connect_to_jobs()
+    pipe = con.pipeline(transaction=False)
+    pipe.hset(job_key(job_id), 'step', step)
+    pipe.hincrby(job_key(job_id), 'steps', 1)
+    pipe.hgetall(job_key(job_id))
+    publish_job(pipe.execute()[-1])
+
+
+def finish(worker, job_id, error=None):
+    con = datastore.connect_to_jobs()
+    pipe = con.pipeline()
+    pipe.hmset(job_key(job_id), {'state': 'failed' if error else 'succeeded',
+                                 'finished': time.time(), 'error': error or ''})
+    pipe.delete(args_key(job_id))
+    pipe.expire(job_key(job_id), int(settings.JOB_RETENTION))
+    pipe.lrem(processing_key(worker), 1, job_id)
+    pipe.hgetall(job_key(job_id))
+    publish_job(pipe.execute()[-1])
+
+
+def publish_job(data):
+    if data.get('controller') and data.get('model'):
+        events.publish(events.job_channel(data['controller'], data['model']),
+                       {'type': 'job', 'action': data['state'], 'id': data['id'], 'data': job_document(data)})
+
+
+def recover(worker):
+    # Jobs a previous run of this worker took but never finished go back in
+    # the queue, unless they already used up all their attempts.
+    con = datastore.connect_to_jobs()
+    recovered = []
+    for job_id in con.lrange(processing_key(worker), 0, -1):
+        if int(con.hget(job_key(job_id), 'attempts') or 0) >= int(settings.JOB_MAX_ATTEMPTS):
+            finish(worker, job_id, 'The worker stopped while running this job')
+        else:
+            pipe = con.pipeline()
+            pipe.hset(job_key(job_id), 'state', 'queued')
+            pipe.rpush(QUEUE_KEY, job_id)
+            pipe.lrem(processing_key(worker), 1, job_id)
+            pipe.execute()
+            recovered.append(job_id)
+    return recovered
+
+
+def get_queue_stats():
+    con = datastore.connect_to_jobs()
+    pipe = con.pipeline(transaction=False)
+    pipe.llen(QUEUE_KEY)
+    pipe.zcard(JOB_INDEX)
+    queued, recent = pipe.execute()
+    return {'queued': queued, 'recent': recent}
+
+
+def job_document(data):
+    return {'id': data['id'],
+            'operation': data.get('script'),
+            'user': data.get('user') or None,
+            'controller': data.get('controller') or None,
+            'model': data.get('model') or None,
+            'state': data.get('state'),
+            'created': timestamp(data.get('created')),
+            'started': timestamp(data.get('started')),
+            'finished': timestamp(data.get('finished')),
+            'attempts': int(data.get('attempts', 0)),
+            'progress': {'steps': int(data.get('steps', 0)), 'step': data.get('step')},
+            'error': data.get('error') or None}
+
+
+def timestamp(value):
+    if value:
+        return datetime.utcfromtimestamp(float(value)).isoformat() + 'Z'
+
+
+def job_visible(data, token):
+    return token.is_admin or data.get('user') == token.username
+
+
+def get_job(job_id, token):
+    data = datastore.connect_to_jobs().hgetall(job_key(job_id))
+    if data and job_visible(data, token):
+        return job_document(data)
+
+
+def get_jobs(token, state=None, limit=100):
+    # The index is read newest first in batches of `limit` ids, so only as many
+    # job documents are fetched as it takes to fill the page.
+    con = datastore.connect_to_jobs()
+    result = []
+    start = 0
+    while len(result) < limit:
+        job_ids = con.zrevrange(JOB_INDEX, start, start + limit - 1)
+        if not job_ids:
+            break
+        start += len(job_ids)
+        pipe = con.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hgetall(job_key(job_id))
+        for data in pipe.execute():
+            if data and job_visible(data, token) and state in [None, data.get('state')]:
+                result.append(job_document(data))
+                if len(result) >= limit:
+                    break
+    return result
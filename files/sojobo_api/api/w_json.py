@@ -0,0 +1,83 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+import json
+from sojobo_api import settings
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+################################################################################
+# JSON BACKENDS
+################################################################################
+# Responses, datastore documents and events are all serialized through here.
+# JSON_BACKEND picks orjson, ujson or json, 'auto' takes the fastest one that
+# is installed. Output is compact JSON, whatever the backend.
+def json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # Non string keys, integers over 64 bits and the like, which the stdlib
+        # does handle.
+        return json_dumps(obj).encode('utf-8')
+
+
+def ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+BACKENDS = {'json': (json_dumps, json.loads)}
+if orjson is not None:
+    BACKENDS['orjson'] = (orjson_dumps, orjson.loads)
+if ujson is not None:
+    BACKENDS['ujson'] = (ujson_dumps, ujson.loads)
+
+
+def select_backend(name):
+    if name == 'auto':
+        return next(b for b in ['orjson', 'ujson', 'json'] if b in BACKENDS)
+    # A configured backend that is not installed falls back to the stdlib.
+    return name if name in BACKENDS else 'json'
+
+
+BACKEND = select_backend(settings.JSON_BACKEND)
+ENCODE, DECODE = BACKENDS[BACKEND]
+
+
+def dumps(obj):
+    data = ENCODE(obj)
+    return data.decode('utf-8') if isinstance(data, bytes) else data
+
+
+def dumps_bytes(obj):
+    data = ENCODE(obj)
+    return data if isinstance(data, bytes) else data.encode('utf-8')
+
+
+def loads(data):
+    return DECODE(data)
+
+
+def get_stats():
+    return {'backend': BACKEND, 'available': sorted(BACKENDS)}
@@ -15,20 +15,39 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
 import asyncio
-from importlib import import_module
+import base64
+import bisect
+import hashlib
+from functools import partial
+from importlib import import_module, reload
 from random import randint
 import os
 import re
-from subprocess import check_output, check_call, Popen
-import json
+from subprocess import check_output, check_call
+from threading import Lock, Thread, get_ident
+import concurrent.futures
+import gzip
+import weakref
+import zlib
 from asyncio_extras import async_contextmanager
 from flask import abort, Response
 from juju import tag
+from juju.client import client
 from juju.controller import Controller
 from juju.errors import JujuAPIError, JujuError
 from juju.model import Model
-from sojobo_api.api import w_errors as errors, w_datastore as datastore
+from sojobo_api.api import w_errors as errors, w_datastore as datastore, w_connections as connections, w_state as state_cache, w_jobs as jobs, w_events as events, w_cache as cache, w_json as serializer
 from sojobo_api import settings
+LOOP = None
+LOOP_PID = None
+LOOP_THREAD = None
+LOOP_LOCK = Lock()
+# Tasks started by fan_out() and the task that started them, so what they log
+# is still attributed to the job that runs them.
+TASK_PARENTS = weakref.WeakKeyDictionary()
+CONTROLLER_TYPES_CHANNEL = '_events:controller-types'
+REGISTRY = {'pid': None, 'types': {}, 'metadata': {}}
+REGISTRY_LOCK = Lock()
 ################################################################################
 # TENGU FUNCTIONS
 ################################################################################
@@ -43,11 +62,16 @@ class JuJu_Token(object):  #pylint: disable=R0903
 
 
 class Controller_Connection(object):
-    def __init__(self, token, c_name):
+    def __init__(self, token, c_name, con=None, user=None):
+        # authorize() passes the cached controller and user documents.
         self.c_name = c_name
-        self.c_access = datastore.get_controller_access(c_name, token.username)
-        self.c_connection = Controller()
-        con = datastore.get_controller(c_name)
+        if user is None:
+            self.c_access = datastore.get_controller_access(c_name, token.username)
+        else:
+            self.c_access = cache.controller_access(user, c_name)
+        self.c_connection = None
+        if con is None:
+            con = datastore.get_controller(c_name)
         self.c_type = con['type']
         if len(con['endpoints']) > 0:
             self.endpoint = con['endpoints'][0]
@@ -57,10 +81,9 @@ class Controller_Connection(object):
             self.c_cacert = None
         self.c_token = getattr(get_controller_types()[self.c_type], 'Token')(self.endpoint, token.username, token.password)
     async def set_controller(self, token, c_name):
-        await self.c_connection.disconnect()
         self.c_name = c_name
         self.c_access = datastore.get_controller_access(token.username, c_name)
-        self.c_connection = Controller()
+        self.c_connection = None
         con = datastore.get_controller(c_name)
         self.c_type = con['type']
         self.endpoint = con['endpoints'][0]
@@ -70,72 +93,335 @@ class Controller_Connection(object):
 
     @async_contextmanager
     async def connect(self, token):
-        nested = False
-        if self.c_connection.connection is None or not self.c_connection.connection.is_open:
-            await self.c_connection.connect(self.endpoint, token.username, token.password, self.c_cacert)
-        else:
-            nested = True
-        yield self.c_connection  #pylint: disable=E1700
-        if not nested:
-            await self.c_connection.disconnect()
+        if self.c_connection is not None:
+            yield self.c_connection  #pylint: disable=E1700
+            return
+        async def login():
+            controller = Controller()
+            await controller.connect(self.endpoint, token.username, token.password, self.c_cacert)
+            return controller
+        key = connections.connection_key(self.endpoint, None, token.username, token.password)
+        self.c_connection = await connections.acquire(key, login)
+        try:
+            yield self.c_connection  #pylint: disable=E1700
+        finally:
+            controller, self.c_connection = self.c_connection, None
+            await connections.release(key, controller)
+
+    async def login(self, token):
+        # Checks the credentials with a login of its own, never through the
+        # pool: an idle pooled connection of another process can still be logged
+        # in with a password that has been changed since.
+        controller = Controller()
+        try:
+            await controller.connect(self.endpoint, token.username, token.password, self.c_cacert)
+        finally:
+            await controller.disconnect()
 
 
 class Model_Connection(object):
-    def __init__(self, token, controller, model):
-        con = datastore.get_controller(controller)
+    def __init__(self, token, controller, model, con=None, user=None):
+        self.m_name = model
+        if con is None:
+            con = datastore.get_controller(controller)
+            self.m_uuid = datastore.get_model(controller, self.m_name)['uuid']
+        else:
+            self.m_uuid = cache.get_model(con, self.m_name)['uuid']
         self.c_endpoint = con['endpoints'][0]
         self.c_cacert = con['ca-cert']
-        self.m_name = model
-        self.m_access = datastore.get_model_access(controller, self.m_name, token.username)
-        self.m_uuid = datastore.get_model(controller, self.m_name)['uuid']
-        self.m_connection = Model()
+        if user is None:
+            self.m_access = datastore.get_model_access(controller, self.m_name, token.username)
+        else:
+            self.m_access = cache.model_access(user, controller, self.m_name)
+        self.m_connection = None
 
     async def set_model(self, token, controller, modelname):
-        await self.m_connection.disconnect()
         self.m_name = modelname
         self.m_uuid = datastore.get_model(controller, self.m_name)['uuid']
-        self.m_connection = Model()
+        self.m_connection = None
         self.m_access = datastore.get_model_access(controller, self.m_name, token.username)
 
     @async_contextmanager
     async def connect(self, token):
-        nested = False
-        if self.m_connection.connection is None or not self.m_connection.connection.is_open:
-            await self.m_connection.connect(self.c_endpoint, self.m_uuid,
-                                            token.username, token.password, self.c_cacert)
-        else:
-            nested = True
-        yield self.m_connection  #pylint: disable=E1700
-        if not nested:
-            await self.m_connection.disconnect()
+        if self.m_connection is not None:
+            yield self.m_connection  #pylint: disable=E1700
+            return
+        async def login():
+            model = Model()
+            await model.connect(self.c_endpoint, self.m_uuid, token.username, token.password, self.c_cacert)
+            return model
+        key = connections.connection_key(self.c_endpoint, self.m_uuid, token.username, token.password)
+        self.m_connection = await connections.acquire(key, login)
+        try:
+            yield self.m_connection  #pylint: disable=E1700
+        finally:
+            model, self.m_connection = self.m_connection, None
+            await connections.release(key, model)
+
+
+async def close_connections():
+    await state_cache.close_all()
+    await connections.close_all()
 
 
 def get_controller_types():
+    # The controller plugins are discovered once per process. A reload, from
+    # the admin endpoint or a SIGHUP of the job worker, is published so every
+    # process picks up the new plugins.
+    with REGISTRY_LOCK:
+        if REGISTRY['pid'] != os.getpid():
+            load_controller_types()
+            events.add_listener(CONTROLLER_TYPES_CHANNEL, on_controller_types_reload)
+        return REGISTRY['types']
+
+
+def load_controller_types():
     c_list = {}
-    for f_path in os.listdir('{}/controllers'.format(settings.SOJOBO_API_DIR)):
-        if 'controller_' in f_path and '.pyc' not in f_path:
+    for f_path in sorted(os.listdir('{}/controllers'.format(settings.SOJOBO_API_DIR))):
+        if 'controller_' in f_path and f_path.endswith('.py'):
             name = f_path.split('.')[0]
-            c_list[name.split('_')[1]] = import_module('sojobo_api.controllers.{}'.format(name))
-    return c_list
+            module = import_module('sojobo_api.controllers.{}'.format(name))
+            if REGISTRY['pid'] == os.getpid():
+                module = reload(module)
+            c_list[name.split('_')[1]] = module
+    REGISTRY.update({'pid': os.getpid(), 'types': c_list, 'metadata': {}})
 
 
-def execute_task(command, *args, **kwargs):
-    loop = asyncio.get_event_loop()
-    loop.set_debug(False)
-    result = loop.run_until_complete(command(*args, **kwargs))
-    return result
+def reload_controller_types(publish=True):
+    with REGISTRY_LOCK:
+        load_controller_types()
+    if publish:
+        events.publish(CONTROLLER_TYPES_CHANNEL, {'type': 'controller-types', 'action': 'reload', 'pid': os.getpid()})
+    return list(REGISTRY['types'])
+
+
+def on_controller_types_reload(event):
+    if event.get('pid') != os.getpid():
+        reload_controller_types(publish=False)
+
+
+def get_controller_metadata(c_type, key):
+    # Supported series and regions are fixed per plugin, so they are asked
+    # only once until the next reload.
+    c_types = get_controller_types()
+    metadata = REGISTRY['metadata'].setdefault(c_type, {})
+    if key not in metadata:
+        metadata[key] = getattr(c_types[c_type], 'get_supported_{}'.format(key))()
+    return metadata[key]
+
+
+def get_controller_types_info():
+    return [{'type': c_type,
+             'regions': get_controller_metadata(c_type, 'regions'),
+             'series': get_controller_metadata(c_type, 'series')} for c_type in get_controller_types()]
+
+
+def get_loop():
+    # Every worker process runs its coroutines on one event loop in a background
+    # thread, so connections and watchers opened by one request outlive it.
+    # Forked workers do not inherit the thread and start their own loop.
+    global LOOP, LOOP_PID, LOOP_THREAD  #pylint: disable=W0603
+    with LOOP_LOCK:
+        if LOOP is None or LOOP_PID != os.getpid():
+            LOOP = asyncio.new_event_loop()
+            LOOP.set_debug(False)
+            LOOP_PID = os.getpid()
+            thread = Thread(target=run_loop, args=(LOOP,), name='juju-event-loop', daemon=True)
+            thread.start()
+            LOOP_THREAD = thread.ident
+    return LOOP
+
+
+def set_loop(loop):
+    # Used by the ASGI entry point: execute_task then submits to the event loop
+    # of the server itself instead of starting a thread of its own.
+    global LOOP, LOOP_PID, LOOP_THREAD  #pylint: disable=W0603
+    with LOOP_LOCK:
+        LOOP, LOOP_PID, LOOP_THREAD = loop, os.getpid(), get_ident()
+
+
+def run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def submit_task(command, *args, **kwargs):
+    loop = get_loop()
+    if get_ident() == LOOP_THREAD:
+        raise RuntimeError('execute_task can not be called from inside a coroutine, await {} instead'.format(command.__name__))
+    return asyncio.run_coroutine_threadsafe(command(*args, **kwargs), loop)
+
+
+async def blocking(function, *args):
+    # Datastore calls are synchronous Redis round trips. Inside a coroutine
+    # they run on the executor of the loop, so one of them never holds up the
+    # other requests served by that loop.
+    return await asyncio.get_event_loop().run_in_executor(None, partial(function, *args))
+
+
+def execute_task(command, *args, task_timeout=None, **kwargs):
+    future = submit_task(command, *args, **kwargs)
+    if task_timeout is None:
+        task_timeout = float(settings.JUJU_TASK_TIMEOUT)
+    try:
+        return future.result(task_timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        error = errors.task_timeout(command.__name__)
+        abort(error[0], error[1])
+
+
+def get_stats():
+    return {'datastore': datastore.get_pool_stats(),
+            'datastore-conflicts': datastore.get_conflict_stats(),
+            'juju-connections': connections.get_stats(),
+            'model-state-cache': state_cache.get_stats(),
+            'jobs': jobs.get_queue_stats(),
+            'authorize-cache': cache.get_stats(),
+            'serializer': serializer.get_stats(),
+            'compression': dict(COMPRESSION)}
 
 
 def create_response(http_code, return_object, is_json=False):
+    headers = {}
+    if isinstance(return_object, Page) and return_object.cursor:
+        headers['X-Next-Cursor'] = return_object.cursor
     if not is_json:
-        return_object = json.dumps(return_object)
+        return_object = serializer.dumps_bytes(return_object)
     return Response(
         return_object,
         status=http_code,
         mimetype='application/json',
+        headers=headers
     )
 
 
+# Bodies smaller than COMPRESS_MIN_SIZE are sent as they are, compressing them
+# costs more than the bytes it saves.
+COMPRESSIBLE = ['application/json', 'text/plain', 'text/html']
+COMPRESSION = {'responses': 0, 'bytes-in': 0, 'bytes-out': 0}
+
+
+def compress_response(response, accept_encodings):
+    if response.mimetype not in COMPRESSIBLE or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not 200 <= response.status_code < 300 or response.status_code == 204 or 'Content-Encoding' in response.headers:
+        return response
+    encoding = accept_encodings.best_match(['gzip', 'deflate'])
+    data = response.get_data()
+    if encoding is None or not accept_encodings[encoding] or len(data) < int(settings.COMPRESS_MIN_SIZE):
+        return response
+    if encoding == 'gzip':
+        compressed = gzip.compress(data, int(settings.COMPRESS_LEVEL))
+    else:
+        compressed = zlib.compress(data, int(settings.COMPRESS_LEVEL))
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # The ETag is the hash of the uncompressed body, so the compressed one only
+    # matches it weakly.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    COMPRESSION['responses'] += 1
+    COMPRESSION['bytes-in'] += len(data)
+    COMPRESSION['bytes-out'] += len(compressed)
+    return response
+###############################################################################
+# LISTINGS
+###############################################################################
+# List endpoints take ?limit=&cursor= to page through the items ordered by
+# name, ?fields=a,b to return only those fields (the name is always kept) and
+# the filters of the endpoint. Without them the full list is returned as before.
+class Page(list):
+    # The cursor of the next page is sent in the X-Next-Cursor header.
+    def __init__(self, items, cursor=None):
+        super().__init__(items)
+        self.cursor = cursor
+
+
+def list_options(args, *filters):
+    try:
+        limit = int(args.get('limit', 0))
+        cursor = args.get('cursor')
+        if cursor:
+            cursor = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        abort(400, 'The limit or cursor of the request is not valid')
+    if not 0 <= limit <= int(settings.LIST_MAX_LIMIT):
+        abort(400, 'The limit can not be negative or larger than {}'.format(settings.LIST_MAX_LIMIT))
+    fields = {f for f in args.get('fields', '').split(',') if f}
+    return {'limit': limit, 'cursor': cursor or None, 'fields': fields or None,
+            'filters': {f: args[f] for f in filters if args.get(f)}}
+
+
+def paginate(names, options):
+    names = sorted(names)
+    if options['cursor'] is not None:
+        names = names[bisect.bisect_right(names, options['cursor']):]
+    if options['limit'] and len(names) > options['limit']:
+        names = names[:options['limit']]
+        return names, base64.urlsafe_b64encode(names[-1].encode('utf-8')).decode('ascii').rstrip('=')
+    return names, None
+
+
+def project(document, fields):
+    if not fields or not isinstance(document, dict):
+        return document
+    return {k: v for k, v in document.items() if k == 'name' or k in fields}
+
+
+def wants(options, field):
+    return not options['fields'] or field in options['fields']
+###############################################################################
+# CONDITIONAL REQUESTS
+###############################################################################
+# The version of a response names the datastore revisions and the model state
+# it is built from. As long as none of them changed, the ETag of the response
+# is known and If-None-Match is answered without building it again. The ETag
+# itself is a digest of the body, so it is the same in every process.
+async def get_model_version(token, controller, model):
+    if not settings.JUJU_STATE_CACHE:
+        return None
+    revisions = await blocking(datastore.get_revisions, ('controller', controller.c_name),
+                               ('access', datastore.model_ref(controller.c_name, model.m_name)))
+    state = None
+    if await blocking(datastore.check_model_state, controller.c_name, model.m_name) == 'ready':
+        state = await state_cache.get_version(model.c_endpoint, model.m_uuid, model.c_cacert)
+    return ('model', controller.c_name, model.m_name, token.username, model.m_access, state) + tuple(revisions)
+
+
+async def get_application_version(model, application):
+    if not settings.JUJU_STATE_CACHE:
+        return None
+    return ('application', model.m_uuid, application,
+            await state_cache.get_version(model.c_endpoint, model.m_uuid, model.c_cacert))
+
+
+def get_user_version(username):
+    return ('user', username) + tuple(datastore.get_revisions(('user', username)))
+
+
+def is_not_modified(request, version):
+    etag = cache.get_etag(version) if version is not None else None
+    return etag is not None and request.if_none_match.contains_weak(etag)
+
+
+def etag_response(request, version, code, response):
+    if code == 304:
+        result = Response(status=304)
+        result.set_etag(cache.get_etag(version))
+        return result
+    result = create_response(code, response)
+    if code == 200 and version is not None:
+        etag = hashlib.sha1(result.get_data()).hexdigest()
+        cache.set_etag(version, etag)
+        result.set_etag(etag)
+        if request.if_none_match.contains_weak(etag):
+            return etag_response(request, version, 304, None)
+    return result
+
+
 def check_input(data, input_type):
     regex_dict = {"controller":{"regex":"^(?!-).*^\S+$", "e_message": "Controller name can not start with a hyphen and can not contain spaces!"},
                   "credential":{"regex":"^[0-9a-zA-Z]([0-9a-zA-Z.-]*[0-9a-zA-Z])$", "e_message": "Credentials may only contain letters, digits and hyphens but can not start with a hyphen"},
@@ -173,20 +459,21 @@ async def authenticate(api_key, auth):
         if auth is None:
             abort(error[0], error[1])
         token = JuJu_Token(auth)
-        if not user_exists(token.username):
+        if not await blocking(user_exists, token.username):
             abort(error[0], error[1])
         try:
-            controllers = get_all_controllers()
-            ready_cons = []
-            for con in controllers:
-                if datastore.get_controller(con)['state'] == 'ready':
-                    ready_cons.append(con)
-            user_state = datastore.get_user_state(token.username)
+            user_state = await blocking(datastore.get_user_state, token.username)
             if user_state == 'ready':
+                if await blocking(datastore.credentials_cached, token.username, token.password):
+                    return token
+                generation = await blocking(datastore.credentials_generation, token.username)
+                controllers = await blocking(get_all_controllers)
+                states = await blocking(datastore.get_controller_states, controllers)
+                ready_cons = [con for con in controllers if states[con] == 'ready']
                 if len(ready_cons) > 0:
-                    controller = Controller_Connection(token, controllers[randint(0, len(controllers) - 1)])
-                    async with controller.connect(token):  #pylint: disable=E1701
-                        pass
+                    controller = await blocking(Controller_Connection, token, ready_cons[randint(0, len(ready_cons) - 1)])
+                    await controller.login(token)
+                    await blocking(datastore.cache_credentials, token.username, token.password, generation)
                     return token
                 else:
                     if token.username == settings.JUJU_ADMIN_USER and token.password == settings.JUJU_ADMIN_PASSWORD:
@@ -204,19 +491,23 @@ async def authenticate(api_key, auth):
 
 
 def authorize(token, controller, model=None):
-    if not controller_exists(controller):
+    # Reads the controller and user documents through the per process cache,
+    # so most requests are authorized without a round trip to Redis.
+    c_doc = cache.get_controller(controller)
+    if not c_doc:
         error = errors.does_not_exist('controller')
         abort(error[0], error[1])
     else:
-        con = Controller_Connection(token, controller)
+        u_doc = cache.get_user(token.username)
+        con = Controller_Connection(token, controller, c_doc, u_doc)
         if not c_access_exists(con.c_access):
             error = errors.does_not_exist('controller')
             abort(error[0], error[1])
-    if model and not model_exists(con, model):
+    if model and cache.get_model(c_doc, model) is None:
         error = errors.does_not_exist('model')
         abort(error[0], error[1])
     elif model:
-        mod = Model_Connection(token, controller, model)
+        mod = Model_Connection(token, controller, model, c_doc, u_doc)
         if not m_access_exists(mod.m_access):
             error = errors.unauthorized()
             abort(error[0], error[1])
@@ -229,7 +520,7 @@ def cloud_supports_series(controller_connection, series):
     if series is None:
         return True
     else:
-        return series in get_controller_types()[controller_connection.c_token.type].get_supported_series()
+        return series in get_controller_metadata(controller_connection.c_token.type, 'series')
 
 
 def check_c_type(c_type):
@@ -241,11 +532,9 @@ def check_c_type(c_type):
 
 
 def create_controller(c_type, name, region, credentials):
-    for controller in get_all_controllers():
-        if datastore.get_controller(controller)['state'] == 'accepted':
-            return 503, 'An environment is already being created'
-    Popen(["python3.6", "{}/scripts/add_controller.py".format(settings.SOJOBO_API_DIR),
-           c_type, name, region, credentials])
+    if 'accepted' in datastore.get_controller_states().values():
+        return 503, 'An environment is already being created'
+    jobs.enqueue('add_controller', 'create_controller', c_type, name, region, credentials)
     return 202, 'Environment {} is being created in region {}'.format(name, region)
 
 
@@ -256,19 +545,45 @@ def remove_cred_file(c_type, name):
     return get_controller_types()[c_type].remove_cred_file(name)
 
 def delete_controller(con):
-    Popen(["python3.6", "{}/scripts/remove_controller.py".format(settings.SOJOBO_API_DIR),
-           con.c_name, con.c_type])
+    jobs.enqueue('remove_controller', 'remove_controller', con.c_name, con.c_type)
 
 def get_supported_regions(c_type):
-    return get_controller_types()[c_type].get_supported_regions()
+    return get_controller_metadata(c_type, 'regions')
 
 def get_all_controllers():
     return datastore.get_all_controllers()
 
 
+async def fan_out(names, function, *args, concurrency=None, timeout=None):
+    # Awaits function(name, *args) for all controllers (or models) at once, with
+    # at most `concurrency` running and each one limited to `timeout` seconds.
+    # One that fails does not stop the others, every name gets a
+    # {'state': 'succeeded' | 'failed', 'error': ...} entry in the result.
+    semaphore = asyncio.Semaphore(int(concurrency or settings.JUJU_FANOUT_CONCURRENCY))
+    timeout = float(timeout or settings.JUJU_FANOUT_TIMEOUT)
+    async def run(name):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(function(name, *args), timeout)
+                return name, {'state': 'succeeded', 'error': None}
+            except asyncio.TimeoutError:
+                return name, {'state': 'failed', 'error': 'No response after {} seconds'.format(timeout)}
+            except Exception as e:  #pylint: disable=W0703
+                return name, {'state': 'failed', 'error': str(e) or type(e).__name__}
+    parent = asyncio.Task.current_task()
+    tasks = [asyncio.ensure_future(run(name)) for name in names]
+    if parent is not None:
+        for task in tasks:
+            TASK_PARENTS[task] = TASK_PARENTS.get(parent, parent)
+    return dict(await asyncio.gather(*tasks))
+
+
+def fan_out_failed(results):
+    return sorted(name for name, result in results.items() if result['state'] == 'failed')
+
+
 def controller_exists(c_name):
-    controllers = get_all_controllers()
-    return c_name in controllers
+    return datastore.controller_exists(c_name)
 
 
 def get_controller_access(con, username):
@@ -276,7 +591,23 @@ def get_controller_access(con, username):
 
 
 def get_controllers_info():
-    return [datastore.get_controller(c) for c in datastore.get_all_controllers()]
+    return datastore.get_controllers(datastore.get_all_controllers())
+
+
+def get_controllers_list(options):
+    # The names of the controllers, or their documents when fields are asked.
+    names = get_all_controllers()
+    if 'state' in options['filters']:
+        states = datastore.get_controller_states(names)
+        names = [c for c in names if states[c] == options['filters']['state']]
+    if 'type' in options['filters']:
+        of_type = set(datastore.get_cloud_controllers(options['filters']['type']))
+        names = [c for c in names if c in of_type]
+    names, cursor = paginate(names, options)
+    if not options['fields']:
+        return Page(names, cursor)
+    controllers = datastore.get_controllers(names, with_models='models' in options['fields'])
+    return Page([project(c, options['fields']) for c in controllers if c], cursor)
 
 
 def get_controller_info(token, controller):
@@ -308,11 +639,7 @@ def get_all_models(controller):
 
 
 def model_exists(controller, modelname):
-    all_models = get_all_models(controller)
-    for model in all_models:
-        if model['name'] == modelname:
-            return True
-    return False
+    return datastore.model_exists(controller.c_name, modelname)
 
 
 def get_model_uuid(controller, model):
@@ -330,33 +657,42 @@ def get_model_access(model, controller, username):
     return datastore.get_model_access(controller, model, username) if not None else "None"
 
 
-def get_models_info(token, controller):
-    result = []
-    for mod in get_all_models(controller):
-        print(mod, datastore.get_model_access(controller.c_name, mod, token.username))
-        if datastore.get_model_access(controller.c_name, mod['name'], token.username) in ['read', 'write', 'admin']:
-            result.append(mod)
-    return result
+def get_models_info(token, controller, options=None):
+    options = options or list_options({})
+    access = datastore.get_models_access(controller.c_name, token.username) or []
+    visible = {m['name'] for m in access if m_access_exists(m['access'])}
+    models = {m['name']: m for m in get_all_models(controller) if m['name'] in visible}
+    names = [m for m in models if options['filters'].get('state') in [None, models[m].get('state')]]
+    names, cursor = paginate(names, options)
+    return Page([project(models[m], options['fields']) for m in names], cursor)
 
 
 async def get_model_info(token, controller, model):
-    state = datastore.check_model_state(controller.c_name, model.m_name)
+    state = await blocking(datastore.check_model_state, controller.c_name, model.m_name)
     if state == 'ready':
+        # Served from the watcher cache the state needs no model connection of
+        # the user; without the cache one connection is shared by every read.
+        if settings.JUJU_STATE_CACHE:
+            return await model_info_document(token, controller, model)
         async with model.connect(token):
-            users = get_users_model(token, controller, model)
-            applications = await get_applications_info(token, model)
-            machines = await get_machines_info(token, model)
-            gui = await get_gui_url(controller, model)
-            credentials = {'cloud': controller.c_type, 'credential-name': get_model_credential(controller, model)}
-        return {'name': model.m_name, 'users': users,
-                'applications': applications, 'machines': machines, 'juju-gui-url' : gui,
-                'state': datastore.check_model_state(controller.c_name, model.m_name), 'credentials' : credentials}
+            return await model_info_document(token, controller, model)
     elif state == 'accepted' or state == 'error':
         return {'name': model.m_name, 'state': state, 'users' : {"user" : token.username, "access" : "admin"}}
     else:
         return {}
 
 
+async def model_info_document(token, controller, model):
+    users = await blocking(get_users_model, token, controller, model)
+    applications = await get_applications_info(token, model)
+    machines = await get_machines_info(token, model)
+    gui = await get_gui_url(controller, model)
+    credentials = {'cloud': controller.c_type, 'credential-name': await blocking(get_model_credential, controller, model)}
+    return {'name': model.m_name, 'users': users,
+            'applications': applications, 'machines': machines, 'juju-gui-url' : gui,
+            'state': await blocking(datastore.check_model_state, controller.c_name, model.m_name), 'credentials' : credentials}
+
+
 async def get_ssh_keys(token, model):
     async with model.connect(token) as juju:
         res = await juju.get_ssh_key(raw_ssh=True)
@@ -371,47 +707,124 @@ def get_ssh_keys_user(user):
     return datastore.get_ssh_keys(user)
 
 
-async def get_applications_info(token, model):
-    result = []
+async def get_model_state(token, model):
+    if settings.JUJU_STATE_CACHE:
+        return await state_cache.get_state(model.c_endpoint, model.m_uuid, model.c_cacert)
     async with model.connect(token) as juju:
-        for data in juju.state.state.get('application', {}).values():
-            res = {'name': data[0]['name'], 'relations': [], 'charm': data[0]['charm-url'], 'exposed': data[0]['exposed'],
-                   'state': data[0]['status']}
-            for rels in juju.state.state['relation'].values():
-                keys = rels[0]['key'].split(" ")
-                if len(keys) == 1 and data[0]['name'] == keys[0].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
-                elif len(keys) == 2 and data[0]['name'] == keys[0].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[1].split(":")[1], 'with': keys[1].split(":")[0]}])
-                elif len(keys) == 2 and data[0]['name'] == keys[1].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
-            res['units'] = await get_units_info(token, model, data[0]['name'])
-            result.append(res)
-    return result
+        return juju.state.state
+
+
+def index_model_state(state):
+    # One pass over the watcher state builds every lookup the read functions
+    # need. Only the latest entry of each history counts, removed entities end
+    # with None and are left out.
+    index = {'application': {}, 'unit': {}, 'machine': {}, 'relations': {}, 'units': {}, 'containers': {}}
+    for entity in ['application', 'unit', 'machine']:
+        for name, history in state.get(entity, {}).items():
+            if history and history[-1] is not None:
+                index[entity][name] = history[-1]
+    for name, data in index['unit'].items():
+        index['units'].setdefault(name.split('/')[0], []).append(data)
+    for name in index['machine']:
+        if '/' in name:
+            index['containers'].setdefault(name.split('/')[0], []).append(name)
+    for history in state.get('relation', {}).values():
+        if not history or history[-1] is None:
+            continue
+        endpoints = [key.split(':') for key in history[-1]['key'].split(' ')]
+        if len(endpoints) == 1:
+            index['relations'].setdefault(endpoints[0][0], []).append({'interface': endpoints[0][1], 'with': endpoints[0][0]})
+        elif endpoints[0][0] == endpoints[1][0]:
+            index['relations'].setdefault(endpoints[0][0], []).append({'interface': endpoints[1][1], 'with': endpoints[1][0]})
+        else:
+            index['relations'].setdefault(endpoints[0][0], []).append({'interface': endpoints[1][1], 'with': endpoints[1][0]})
+            index['relations'].setdefault(endpoints[1][0], []).append({'interface': endpoints[0][1], 'with': endpoints[0][0]})
+    return index
 
 
-async def get_units_info(token, model, application):
+async def get_model_index(token, model):
+    return index_model_state(await get_model_state(token, model))
+
+
+async def wait_for_state(model, check):
+    # Writes go through the connection of the user, reads come from the watcher
+    # of the state cache. A write waits until the watcher has its change, so a
+    # read right after it sees the change too.
+    if not settings.JUJU_STATE_CACHE:
+        return
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + float(settings.JUJU_STATE_SYNC_TIMEOUT)
+    while not check(await state_cache.get_state(model.c_endpoint, model.m_uuid, model.c_cacert)):
+        if loop.time() >= deadline:
+            return
+        await asyncio.sleep(0.1)
+
+
+def latest(state, entity, name):
+    history = state.get(entity, {}).get(name)
+    return history[-1] if history else None
+
+
+def has_relation(state, app1, app2):
+    for history in state.get('relation', {}).values():
+        if history and history[-1] is not None:
+            apps = [key.split(':')[0] for key in history[-1]['key'].split(' ')]
+            if app1 in apps and app2 in apps:
+                return True
+    return False
+
+
+async def entity_exists(token, model, entity, name):
+    # Existence checks look up the one entity instead of building the index.
+    history = (await get_model_state(token, model)).get(entity, {}).get(name)
+    return bool(history) and history[-1] is not None
+
+
+def application_document(index, name, options=None):
+    # Relations and units are only gathered when they are asked for.
+    options = options or list_options({})
+    data = index['application'][name]
+    result = {'name': data['name'], 'charm': data['charm-url'], 'exposed': data['exposed'], 'state': data['status']}
+    if wants(options, 'relations'):
+        result['relations'] = index['relations'].get(name, [])
+    if wants(options, 'units'):
+        result['units'] = units_document(index, name)
+    return project(result, options['fields'])
+
+
+def status_value(status):
+    return status.get('current') if isinstance(status, dict) else status
+
+
+def units_document(index, application):
     try:
-        async with model.connect(token) as juju:
-            data = juju.state.state['unit']
-        units = []
-        result = []
-        for unit in data.keys():
-            if unit.startswith(application):
-                units.append(data[unit][0])
-        for u in units:
-            ports = get_unit_ports(u)
-            result.append({'name': u['name'],
-                           'machine': u['machine-id'],
-                           'public-ip': u['public-address'],
-                           'private-ip': u['private-address'],
-                           'series': u['series'],
-                           'ports': ports})
-        return result
+        return [unit_document(u) for u in index['units'].get(application, [])]
     except KeyError:
         return []
 
 
+def unit_document(u):
+    return {'name': u['name'],
+            'machine': u['machine-id'],
+            'public-ip': u['public-address'],
+            'private-ip': u['private-address'],
+            'series': u['series'],
+            'ports': get_unit_ports(u)}
+
+
+async def get_applications_info(token, model, options=None):
+    options = options or list_options({})
+    index = await get_model_index(token, model)
+    state = options['filters'].get('state')
+    names = [a for a in index['application'] if state in [None, status_value(index['application'][a]['status'])]]
+    names, cursor = paginate(names, options)
+    return Page([application_document(index, name, options) for name in names], cursor)
+
+
+async def get_units_info(token, model, application):
+    return units_document(await get_model_index(token, model), application)
+
+
 async def get_public_ip_controller(token, controller):
     async with controller.connect(token) as juju:
         servers = juju.info['servers']
@@ -435,8 +848,7 @@ def create_model(token, controller, model, credentials):
         datastore.add_model_to_controller(controller, model)
         datastore.set_model_state(controller, model, 'accepted')
         datastore.set_model_access(controller, model, token.username, 'admin')
-        Popen(["python3.6", "{}/scripts/add_model.py".format(settings.SOJOBO_API_DIR), controller,
-               model, settings.SOJOBO_API_DIR, token.username, token.password, credentials])
+        jobs.enqueue('add_model', 'create_model', controller, model, token.username, token.password, credentials)
         code, response = 202, "Model is being deployed"
     else:
         code, response = 404, "Credentials {} not found!".format(credentials)
@@ -446,71 +858,49 @@ def create_model(token, controller, model, credentials):
 async def delete_model(token, controller, model):
     async with controller.connect(token) as juju:
         await juju.destroy_models(model.m_uuid)
-    datastore.delete_model(controller.c_name, model.m_name)
+    await state_cache.forget(model.m_uuid)
+    await blocking(datastore.delete_model, controller.c_name, model.m_name)
     return "Model {} is being deleted".format(model.m_name)
 #####################################################################################
 # Machines FUNCTIONS
 #####################################################################################
-async def get_machines_info(token, model):
-    result = {}
-    async with model.connect(token) as juju:
-        for machine, data in juju.state.state.get('machine', {}).items():
-            try:
-                if data[0]['agent-status']['current'] == 'error' and data[0]['addresses'] is None:
-                    result[machine] = {'name': machine, 'Error': data[0]['agent-status']['message']}
-                if data[0] is None:
-                    result[machine] = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown',
-                                       'series': 'Unknown', 'containers': 'Unknown',
-                                       'hardware-characteristics' : 'Unknown'}
-                if 'lxd' in machine:
-                    result[machine.split('/')[0]].get('containers', []).append({
-                        'name': machine, 'instance-id': data[0]['instance-id'],
-                        'ip': get_machine_ip(data[0]), 'series': data[0]['series']
-                    })
-                else:
-                    result[machine] = {
-                        'name': machine,
-                        'instance-id': data[0]['instance-id'],
-                        'ip': get_machine_ip(data[0]),
-                        'series': data[0]['series'],
-                        'hardware-characteristics': data[0]['hardware-characteristics']
-                    }
-            except KeyError:
-                result[machine] = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown',
-                                   'containers': 'Unknown', 'hardware-characteristics' : 'Unknown'}
-    return [info for info in result.values()]
+async def get_machines_info(token, model, options=None):
+    options = options or list_options({})
+    index = await get_model_index(token, model)
+    names = [m for m in index['machine'] if '/' not in m]
+    series = options['filters'].get('series')
+    if series:
+        names = [m for m in names if index['machine'][m].get('series') == series]
+    application = options['filters'].get('application')
+    if application:
+        # The machines hosting a unit of the application, or a container that does.
+        hosts = {u['machine-id'].split('/')[0] for u in index['units'].get(application, []) if u.get('machine-id')}
+        names = [m for m in names if m in hosts]
+    names, cursor = paginate(names, options)
+    return Page([machine_document(index, machine, options) for machine in names], cursor)
 
 
 async def get_machine_info(token, model, machine):
+    return machine_document(await get_model_index(token, model), machine)
+
+
+def machine_document(index, machine, options=None):
+    options = options or list_options({})
     try:
-        async with model.connect(token) as juju:
-            data = juju.state.state['machine']
-        machine_data = data[machine][0]
+        machine_data = index['machine'][machine]
         if machine_data['agent-status']['current'] == 'error' and machine_data['addresses'] is None:
-            result = {'name': machine, 'Error': machine_data['agent-status']['message']}
-            return result
-        if machine_data is None:
-            result = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown', 'containers': 'Unknown', 'hardware-characteristics' : 'unknown'}
-            return result
-        containers = []
-        if not 'lxd' in machine:
-            lxd = []
-            for key in data.keys():
-                if key.startswith('{}/lxd'.format(machine)):
-                    lxd.append(key)
-            if lxd != []:
-                for cont in lxd:
-                    cont_data = data[cont][0]
-                    ip = get_machine_ip(cont_data)
-                    containers.append({'name': cont, 'instance-id': cont_data['instance-id'], 'ip': ip, 'series': cont_data['series']})
-            mach_ip = get_machine_ip(machine_data)
-            result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': mach_ip, 'series': machine_data['series'], 'hardware-characteristics' : machine_data['hardware-characteristics'], 'containers': containers}
-        else:
-            mach_ip = get_machine_ip(machine_data)
-            result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': mach_ip, 'series': machine_data['series'], 'hardware-characteristics' : machine_data['hardware-characteristics']}
+            return {'name': machine, 'Error': machine_data['agent-status']['message']}
+        result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': get_machine_ip(machine_data),
+                  'series': machine_data['series'], 'hardware-characteristics' : machine_data['hardware-characteristics']}
+        if '/' not in machine and wants(options, 'containers'):
+            result['containers'] = []
+            for cont in index['containers'].get(machine, []):
+                cont_data = index['machine'][cont]
+                result['containers'].append({'name': cont, 'instance-id': cont_data['instance-id'],
+                                             'ip': get_machine_ip(cont_data), 'series': cont_data['series']})
     except KeyError:
         result = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown', 'containers': 'Unknown', 'hardware-characteristics' : 'unknown'}
-    return result
+    return project(result, options['fields'])
 
 
 def get_machine_ip(machine_data):
@@ -531,29 +921,26 @@ async def add_machine(token, model, ser=None, cont=None):
 
 
 async def machine_exists(token, model, machine):
-    async with model.connect(token) as juju:
-        return machine in juju.state.state.get('machine', {}).keys()
+    return await entity_exists(token, model, 'machine', machine)
 
 
 def remove_machine(token, controller, model, machine):
-    Popen(["python3.6", "{}/scripts/remove_machine.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-           controller.c_name, model.m_name, machine])
+    jobs.enqueue('remove_machine', 'remove_machine', controller.c_name, model.m_name, token.username,
+                 token.password, machine)
 #####################################################################################
 # APPLICATION FUNCTIONS
 #####################################################################################
-async def app_exists(token, controller, model, app_name):
-    model_info = await get_model_info(token, controller, model)
-    for app in model_info['applications']:
-        if app['name'] == app_name:
-            return True
-    return False
+async def app_exists(token, controller, model, app_name):  #pylint: disable=W0613
+    return await entity_exists(token, model, 'application', app_name)
+
+
+async def unit_exists(token, model, application, unitnumber):
+    return await entity_exists(token, model, 'unit', '{}/{}'.format(application, unitnumber))
 
 
 def add_bundle(token, controller, model, bundle):
-    Popen(["python3.6", "{}/scripts/bundle_deployment.py".format(settings.SOJOBO_API_DIR),
-           token.username, token.password, settings.SOJOBO_API_DIR, controller, model,
-           str(bundle), settings.REDIS_HOST, settings.REDIS_PORT])
+    jobs.enqueue('bundle_deployment', 'deploy_bundle', token.username, token.password, controller, model,
+                 str(bundle))
 
 
 async def deploy_app(token, con, model, app_name, data):
@@ -561,7 +948,7 @@ async def deploy_app(token, con, model, app_name, data):
     if(cloud_supports_series(con, ser)):
         conf = data.get('config', None)
         machine = data.get('target', None)
-        if machine and not machine_exists(token, model, machine):
+        if machine and not await machine_exists(token, model, machine):
             error = errors.does_not_exist(machine)
             abort(error[0], error[1])
         units = data.get('units', "1")
@@ -571,6 +958,7 @@ async def deploy_app(token, con, model, app_name, data):
             except JujuError as e:
                 if e == 'subordinate application must be deployed without units':
                     await juju.deploy(app_name, application_name=app_name, series=ser, config=conf, num_units=0)
+        await wait_for_state(model, lambda state: latest(state, 'application', app_name) is not None)
     else:
         error = errors.invalid_option(data)
         abort(error[0], error[1])
@@ -586,12 +974,14 @@ async def expose_app(token, model, app_name):
     async with model.connect(token):
         app = await get_application_entity(token, model, app_name)
         await app.expose()
+    await wait_for_state(model, lambda state: (latest(state, 'application', app_name) or {}).get('exposed') is True)
 
 
 async def unexpose_app(token, model, app_name):
     async with model.connect(token):
         app = await get_application_entity(token, model, app_name)
         await app.unexpose()
+    await wait_for_state(model, lambda state: (latest(state, 'application', app_name) or {}).get('exposed') is False)
 
 
 async def get_application_entity(token, model, app_name):
@@ -609,22 +999,22 @@ async def remove_app(token, model, app_name):
 
 
 async def get_application_info(token, model, applic):
-    for app in await get_applications_info(token, model):
-        if app['name'] == applic:
-            return app
+    index = await get_model_index(token, model)
+    if applic in index['application']:
+        return application_document(index, applic)
 
 
 async def get_unit_info(token, model, application, unitnumber):
-    for u in await get_units_info(token, model, application):
-        if u['name'] == '{}/{}'.format(application, unitnumber):
-            return u
-    return {}
+    index = await get_model_index(token, model)
+    try:
+        return unit_document(index['unit']['{}/{}'.format(application, unitnumber)])
+    except KeyError:
+        return {}
 
 
 def add_unit(token, controller, model, app_name, amount, target):
-    Popen(["python3.6", "{}/scripts/add_unit.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-           controller.c_name, model.m_name, app_name, str(amount), target])
+    jobs.enqueue('add_unit', 'add_unit', controller.c_name, model.m_name, token.username, token.password,
+                 app_name, str(amount), target)
 
 
 async def remove_unit(token, model, application, unit_number):
@@ -642,13 +1032,14 @@ def get_unit_ports(unit):
 
 
 async def get_relations_info(token, model):
-    data = await get_applications_info(token, model)
-    return [{'name': a['name'], 'relations': a['relations']} for a in data]
+    index = await get_model_index(token, model)
+    return [{'name': name, 'relations': index['relations'].get(name, [])} for name in index['application']]
 
 
 async def add_relation(token, model, app1, app2):
     async with model.connect(token) as juju:
         await juju.add_relation(app1, app2)
+    await wait_for_state(model, lambda state: has_relation(state, app1, app2))
 
 
 async def remove_relation(token, model, app1, app2):
@@ -685,25 +1076,29 @@ async def get_application_config(token, model, app_name):
 # USER FUNCTIONS
 ###############################################################################
 def create_user(username, password):
-    Popen(["python3.6", "{}/scripts/add_user.py".format(settings.SOJOBO_API_DIR), username, password])
+    jobs.enqueue('add_user', 'create_user', username, password)
 
 
 def delete_user(username):
-    Popen(["python3.6", "{}/scripts/delete_user.py".format(settings.SOJOBO_API_DIR), username])
+    datastore.revoke_credentials(username)
+    execute_task(connections.evict_user, username)
+    jobs.enqueue('delete_user', 'delete_user', username)
 
 
 async def change_user_password(token, username, password):
-    for con in get_all_controllers():
-        controller = Controller_Connection(token, con)
+    async def change_password(c_name):
+        controller = await blocking(Controller_Connection, token, c_name)
         async with controller.connect(token) as juju:  #pylint: disable=E1701
             await juju.change_user_password(username, password)
+    results = await fan_out(await blocking(get_all_controllers), change_password)
+    # Even a partial change makes the cached logins of the user invalid.
+    await blocking(datastore.revoke_credentials, username)
+    await connections.evict_user(username)
+    return results
 
 
 def update_ssh_keys_user(user, ssh_keys):
-    Popen([
-        "python3.6",
-        "{}/scripts/update_ssh_keys.py".format(settings.SOJOBO_API_DIR),
-        str(ssh_keys), user, settings.SOJOBO_API_DIR])
+    jobs.enqueue('update_ssh_keys', 'remove_ssh_key', str(ssh_keys), user)
 
 
 def get_users_controller(controller):
@@ -732,11 +1127,11 @@ def get_credential(user, credential):
 
 
 def add_credential(user, credential):
-    Popen(["python3.6", "{}/scripts/add_credential.py".format(settings.SOJOBO_API_DIR), user, str(credential), settings.SOJOBO_API_DIR])
+    jobs.enqueue('add_credential', 'add_credential', user, str(credential))
 
 
 def remove_credential(user, cred_name):
-    Popen(["python3.6", "{}/scripts/remove_credential.py".format(settings.SOJOBO_API_DIR), user, cred_name, settings.SOJOBO_API_DIR])
+    jobs.enqueue('remove_credential', 'remove_credential', user, cred_name)
 
 
 def credential_exists(user, credential):
@@ -746,8 +1141,7 @@ def credential_exists(user, credential):
     return False
 
 def grant_user_to_controller(token, controller, user, access):
-    Popen(["python3.6", "{}/scripts/set_controller_access.py".format(settings.SOJOBO_API_DIR),
-           controller.c_name, access, settings.SOJOBO_API_DIR, user])
+    jobs.enqueue('set_controller_access', 'set_controller_acc', controller.c_name, access, user)
 
 
 async def controller_grant(token, controller, username, access):
@@ -769,9 +1163,8 @@ def set_models_access(token, controller, user, accesslist):
                 pass
         else:
             abort(404, 'Model {} not found'.format(mod['name']))
-    Popen(["python3.6", "{}/scripts/set_model_access.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR,
-           user, str(accesslist), controller.c_name])
+    jobs.enqueue('set_model_access', 'set_model_acc', token.username, token.password, user, str(accesslist),
+                 controller.c_name)
 
 
 async def model_grant(token, model, username, access):
@@ -779,28 +1172,84 @@ async def model_grant(token, model, username, access):
         await juju.grant(username, acl=access)
 
 
+async def modify_models_access(con_juju, action, changes):
+    # One ModelManager call for any number of users and models of a controller,
+    # changes is a list of (username, uuid, access). Returns the error of every
+    # change or None.
+    if not changes:
+        return []
+    facade = client.ModelManagerFacade.from_connection(con_juju.connection)
+    res = await facade.ModifyModelAccess([client.ModifyModelAccess(acl, action, tag.model(uuid), tag.user(username))
+                                          for username, uuid, acl in changes])
+    return [r.error.message if r.error else None for r in res.results]
+
+
+async def update_models_ssh_keys(token, c_name, models, username, add_keys, remove_keys=None):
+    # Every model gets one KeyManager call per change instead of one per key,
+    # the models are updated concurrently. Malformed keys are left out, see
+    # invalid_ssh_keys(); a key Juju rejects makes the update of that model fail
+    # with the error of every rejected key.
+    add = {ssh_key_fingerprint(k): k for k in add_keys or [] if ssh_key_fingerprint(k)}
+    remove = [f for f in (ssh_key_fingerprint(k) for k in remove_keys or []) if f]
+    async def update_keys(m_name):
+        model = await blocking(Model_Connection, token, c_name, m_name)
+        rejected = []
+        async with model.connect(token) as mod_con:  #pylint: disable=E1701
+            facade = client.KeyManagerFacade.from_connection(mod_con.connection)
+            if remove:
+                res = await facade.DeleteKeys(remove, username)
+                rejected.extend(key_errors('removing', remove, res))
+            if add:
+                res = await facade.AddKeys(list(add.values()), username)
+                rejected.extend(key_errors('adding', list(add), res))
+        if rejected:
+            raise JujuError('; '.join(rejected))
+    return await fan_out(models, update_keys)
+
+
+def key_errors(action, fingerprints, res):
+    return ['{} {}: {}'.format(action, fingerprint, r.error.message)
+            for fingerprint, r in zip(fingerprints, res.results) if r.error]
+
+
+def ssh_key_fingerprint(key):
+    # None for a key that is not '<type> <base64 data> [comment]'.
+    try:
+        data = base64.b64decode(key.strip().split()[1].encode('ascii'), validate=True)
+    except (AttributeError, IndexError, ValueError):
+        return None
+    digest = hashlib.md5(data).hexdigest()
+    return ':'.join(a + b for a, b in zip(digest[::2], digest[1::2]))
+
+
+def invalid_ssh_keys(keys):
+    return [k for k in keys or [] if ssh_key_fingerprint(k) is None]
+
+
 async def remove_user_from_model(token, controller, model, username):
     async with model.connect(token) as juju:
         await juju.revoke(username)
-    datastore.remove_model(controller.c_name, model.m_name, username)
+    await blocking(datastore.remove_model, controller.c_name, model.m_name, username)
 
 
 def user_exists(username):
-    return username in get_all_users()
+    return datastore.user_exists(username)
 
 
 def get_all_users():
     return datastore.get_all_users()
 
 
-def get_users_info(token):
+def get_users_info(token, options=None):
+    options = options or list_options({})
     if token.is_admin:
-        result = []
-        for user in get_all_users():
-            u_info = get_user_info(user)
-            if u_info['state'] == 'ready':
-                result.append(u_info)
-        return result
+        # Only the users of the requested page are read, by default the ready ones.
+        names = get_all_users()
+        states = datastore.get_user_states(names)
+        names = [u for u in names if states[u] == options['filters'].get('state', 'ready')]
+        names, cursor = paginate(names, options)
+        users = datastore.get_users(names, with_controllers=wants(options, 'controllers'))
+        return Page([project(u, options['fields']) for u in users if u], cursor)
     else:
         return datastore.get_user(token.username)
 
@@ -0,0 +1,227 @@
+#!/usr/bin/python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+import asyncio
+from datetime import datetime, timezone
+import re
+import time
+from juju.model import Model
+from sojobo_api import settings
+################################################################################
+# MODEL STATE CACHE
+################################################################################
+# Every cached model keeps one model connection open. libjuju runs the
+# AllWatcher for as long as that connection lives and applies each delta to
+# model.state, so reads get the current applications, units, machines and
+# relations without logging in and replaying the whole delta stream again.
+# Access is checked by authorize() before a request gets here, so the watcher
+# itself logs in as the Tengu admin.
+CACHES = {}
+SINCE = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?Z$')
+
+
+class ModelState(object):
+    def __init__(self, endpoint, uuid, cacert):
+        self.endpoint = endpoint
+        self.uuid = uuid
+        self.cacert = cacert
+        self.model = None
+        self.opened = None
+        self.used = time.monotonic()
+        self.last_delta = None
+        self.deltas = 0
+        self.reconnects = 0
+        self.lag = None
+        self.max_lag = 0.0
+        self.subscribers = set()
+
+    @property
+    def is_open(self):
+        return self.model is not None and self.model.connection is not None and self.model.connection.is_open
+
+    async def open(self):
+        if self.model is not None:
+            self.reconnects += 1
+            await self.close()
+        model = Model()
+        model.add_observer(self.on_delta)
+        await model.connect(self.endpoint, self.uuid, settings.JUJU_ADMIN_USER,
+                            settings.JUJU_ADMIN_PASSWORD, self.cacert)
+        self.model = model
+        self.opened = time.monotonic()
+
+    async def close(self):
+        model, self.model = self.model, None
+        if model is not None:
+            try:
+                await model.disconnect()
+            except Exception:  #pylint: disable=W0703
+                pass
+
+    async def on_delta(self, delta, old, new, model):  #pylint: disable=W0613
+        self.deltas += 1
+        trim_history(model.state.state, delta.entity, delta.get_id())
+        self.last_delta = time.monotonic()
+        since = delta_since(delta.data)
+        if since is not None:
+            self.lag = max(0.0, (datetime.now(timezone.utc) - since).total_seconds())
+            self.max_lag = max(self.max_lag, self.lag)
+        if self.subscribers and delta.entity in ['application', 'unit', 'machine']:
+            event = {'type': delta.entity, 'action': delta.type, 'id': delta.get_id(), 'data': delta.data}
+            for callback in list(self.subscribers):
+                callback(event)
+
+    @property
+    def version(self):
+        # Changes with every delta, and with every reconnect as the state is
+        # then received again from scratch.
+        return '{}.{}.{}'.format(id(self), self.opened, self.deltas)
+
+    def get_stats(self):
+        now = time.monotonic()
+        return {'uuid': self.uuid,
+                'open': self.is_open,
+                'age': None if self.opened is None else now - self.opened,
+                'idle': now - self.used,
+                'staleness': None if self.last_delta is None else now - self.last_delta,
+                'lag': self.lag,
+                'max-lag': self.max_lag,
+                'deltas': self.deltas,
+                'reconnects': self.reconnects,
+                'subscribers': len(self.subscribers)}
+
+
+class ModelStateCache(object):
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self.models = {}
+        self.opening = {}
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0}
+
+    async def get(self, endpoint, uuid, cacert):
+        await self.expire()
+        entry = self.models.get(uuid)
+        if entry is not None and entry.is_open:
+            self.stats['hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            if uuid not in self.opening:
+                self.opening[uuid] = asyncio.ensure_future(self.open(entry or ModelState(endpoint, uuid, cacert)))
+            entry = await asyncio.shield(self.opening[uuid])
+        entry.used = time.monotonic()
+        return entry
+
+    async def open(self, entry):
+        try:
+            await entry.open()
+            self.models[entry.uuid] = entry
+            return entry
+        finally:
+            del self.opening[entry.uuid]
+
+    async def expire(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for uuid, entry in list(self.models.items()):
+            if entry.used < deadline and not entry.subscribers:
+                self.stats['expired'] += 1
+                del self.models[uuid]
+                await entry.close()
+
+    async def forget(self, uuid):
+        entry = self.models.pop(uuid, None)
+        if entry is not None:
+            await entry.close()
+
+    async def close_all(self):
+        for uuid in list(self.models):
+            await self.forget(uuid)
+
+    def get_stats(self):
+        return dict(self.stats, models=[entry.get_stats() for entry in self.models.values()])
+
+
+def trim_history(state, entity, entity_id):
+    # libjuju keeps every delta of an entity in its history, only the latest
+    # one is read here. A removed entity is dropped altogether.
+    entities = state.get(entity, {})
+    history = entities.get(entity_id)
+    if history is None:
+        return
+    while len(history) > 1:
+        history.popleft()
+    if history[-1] is None:
+        del entities[entity_id]
+
+
+def delta_since(data):
+    # Status changes carry the time the controller recorded them, which gives
+    # the delay between a change in the model and the delta reaching us.
+    stamps = []
+    for field in ['status', 'agent-status', 'workload-status', 'instance-status']:
+        status = data.get(field) if isinstance(data, dict) else None
+        if isinstance(status, dict) and status.get('since'):
+            stamps.append(status['since'])
+    if stamps:
+        return parse_since(max(stamps))
+
+
+def parse_since(value):
+    # Juju reports UTC with nanoseconds, strptime only parses up to microseconds.
+    match = SINCE.match(value)
+    if match:
+        stamp, fraction = match.groups()
+        stamp = '{}.{}'.format(stamp, (fraction or '0')[:6])
+        return datetime.strptime(stamp, '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=timezone.utc)
+
+
+def get_cache():
+    loop = asyncio.get_event_loop()
+    if loop not in CACHES:
+        CACHES[loop] = ModelStateCache(float(settings.JUJU_STATE_CACHE_IDLE))
+    return CACHES[loop]
+
+
+async def get_state(endpoint, uuid, cacert):
+    entry = await get_cache().get(endpoint, uuid, cacert)
+    return entry.model.state.state
+
+
+async def get_version(endpoint, uuid, cacert):
+    return (await get_cache().get(endpoint, uuid, cacert)).version
+
+
+async def subscribe(endpoint, uuid, cacert, callback):
+    entry = await get_cache().get(endpoint, uuid, cacert)
+    entry.subscribers.add(callback)
+
+
+async def unsubscribe(uuid, callback):
+    entry = get_cache().models.get(uuid)
+    if entry is not None:
+        entry.subscribers.discard(callback)
+        entry.used = time.monotonic()
+
+
+async def forget(uuid):
+    await get_cache().forget(uuid)
+
+
+async def close_all():
+    await get_cache().close_all()
+
+
+def get_stats():
+    return [cache.get_stats() for cache in CACHES.values()]
@@ -0,0 +1,525 @@
+# !/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,e0401,e0611,c0413
+# ASGI entry point, the async counterpart of passenger_wsgi.py. Serve it from
+# the api directory with any ASGI server, e.g.:
+#     uvicorn --workers 4 asgi:application
+# The routes that wait on Juju, reads as well as the writes that await a model
+# or controller call, and the Users reads are handled by coroutines awaiting
+# w_juju directly on the server's event loop. Every other route only queues a
+# job and is passed on to the Flask application, which runs in a thread pool,
+# so the whole API keeps the same routes and JSON contract.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from flask import Request, Response
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from sojobo_api import settings
+from sojobo_api.sojobo_api import APP, apply_caching
+from sojobo_api.api import w_errors as errors, w_juju as juju, w_events as events
+from sojobo_api.api.api_tengu import LOGGER, error_log
+################################################################################
+# NATIVE HANDLERS
+################################################################################
+async def get_model_info(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    version = await juju.get_model_version(token, con, mod)
+    if juju.is_not_modified(request, version):
+        return 304, None, version
+    return 200, await juju.get_model_info(token, con, mod), version
+
+
+async def get_applications_info(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    return 200, await juju.get_applications_info(token, mod, juju.list_options(request.args, 'state'))
+
+
+async def get_application_info(request, controller, model, application):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if await juju.app_exists(token, con, mod, application):
+        version = await juju.get_application_version(mod, application)
+        if juju.is_not_modified(request, version):
+            return 304, None, version
+        return 200, await juju.get_application_info(token, mod, application), version
+    return errors.does_not_exist('application')
+
+
+async def get_application_config(request, controller, model, application):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    return 200, await juju.get_application_config(token, mod, application)
+
+
+async def get_machines_info(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    return 200, await juju.get_machines_info(token, mod, juju.list_options(request.args, 'series', 'application'))
+
+
+async def get_machine_info(request, controller, model, machine):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if await juju.machine_exists(token, mod, machine):
+        return 200, await juju.get_machine_info(token, mod, machine)
+    return errors.does_not_exist('machine')
+
+
+async def get_units_info(request, controller, model, application):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if await juju.app_exists(token, con, mod, application):
+        return 200, await juju.get_units_info(token, mod, application)
+    return errors.does_not_exist('application')
+
+
+async def get_unit_info(request, controller, model, application, unitnumber):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    return 200, await juju.get_unit_info(token, mod, application, unitnumber)
+
+
+async def get_relations_info(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    return 200, await juju.get_relations_info(token, mod)
+
+
+async def get_relations(request, controller, model, application):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if await juju.app_exists(token, con, mod, application):
+        return 200, (await juju.get_application_info(token, mod, application))['relations']
+    return errors.does_not_exist('application')
+
+
+async def delete_model(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if mod.m_access == 'admin':
+        return 202, await juju.delete_model(token, con, mod)
+    return errors.no_permission()
+
+
+async def add_application(request, controller, model):
+    data = request.json
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    app = data['application']
+    if await juju.app_exists(token, con, mod, app):
+        return errors.already_exists('application')
+    if mod.m_access in ['write', 'admin']:
+        await juju.deploy_app(token, con, mod, app, data)
+        return 200, await juju.get_application_info(token, mod, app)
+    return errors.no_permission()
+
+
+async def expose_application(request, controller, model, application):
+    exposed = request.json['expose'] == "True"
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if await juju.check_if_exposed(token, mod, application) != exposed:
+        if exposed:
+            await juju.expose_app(token, mod, application)
+        else:
+            await juju.unexpose_app(token, mod, application)
+    return 200, await juju.get_application_info(token, mod, application)
+
+
+async def remove_app(request, controller, model, application):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if mod.m_access not in ['write', 'admin']:
+        return errors.no_permission()
+    if await juju.app_exists(token, con, mod, application):
+        await juju.remove_app(token, mod, application)
+        return 202, "The application is being removed"
+    return errors.does_not_exist('application')
+
+
+async def set_application_config(request, controller, model, application):
+    data = request.json
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if mod.m_access in ['write', 'admin']:
+        await juju.set_application_config(token, mod, application, data.get('config', None))
+        return 202, "The config parameter is being changed"
+    return errors.no_permission()
+
+
+async def add_machine(request, controller, model):
+    data = request.json
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if mod.m_access not in ['write', 'admin']:
+        return errors.no_permission()
+    constraints = data.get('constraints', None)
+    if constraints:
+        juju.check_constraints(data.get(constraints, True))
+    series = data.get('series', None)
+    if juju.cloud_supports_series(con, series):
+        await juju.add_machine(token, mod, series, constraints)
+        return 202, 'Machine is being deployed!'
+    return 400, 'This cloud does not support this version of Ubuntu'
+
+
+async def remove_unit(request, controller, model, application, unitnumber):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if not await juju.unit_exists(token, mod, application, unitnumber):
+        return errors.does_not_exist('unit')
+    if mod.m_access in ['write', 'admin']:
+        await juju.remove_unit(token, mod, application, unitnumber)
+        return 202, "Unit is being removed"
+    return errors.no_permission()
+
+
+async def add_relation(request, controller, model):
+    data = request.json
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    app1, app2 = data['app1'], data['app2']
+    if not (await juju.app_exists(token, con, mod, app1) and await juju.app_exists(token, con, mod, app2)):
+        return errors.does_not_exist('application')
+    if mod.m_access in ['write', 'admin']:
+        await juju.add_relation(token, mod, app1, app2)
+        return 200, await juju.get_relations_info(token, mod)
+    return errors.no_permission()
+
+
+async def remove_relation(request, controller, model, app1, app2):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if not (await juju.app_exists(token, con, mod, app1) and await juju.app_exists(token, con, mod, app2)):
+        return errors.does_not_exist('application')
+    if mod.m_access in ['write', 'admin']:
+        await juju.remove_relation(token, mod, app1, app2)
+        return 202, 'The relation is being removed'
+    return errors.no_permission()
+
+
+async def get_model_events(request, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    _, mod = await juju.blocking(juju.authorize, token, controller, model)
+    try:
+        timeout = min(float(request.args.get('timeout', settings.EVENTS_POLL_TIMEOUT)), float(settings.EVENTS_POLL_TIMEOUT))
+    except ValueError:
+        return errors.invalid_data()
+    subscription = events.Subscription(asyncio.get_event_loop())
+    await events.subscribe_model(controller, mod, subscription)
+    try:
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return await stream_events(request, subscription)
+        # Events between two polls are missed, see events.poll.
+        first = await subscription.get_async(timeout)
+        return 200, [] if first is None else [first] + subscription.drain()
+    finally:
+        await events.unsubscribe_model(controller, mod, subscription)
+
+
+async def stream_events(request, subscription):
+    send = request.environ['asgi.send']
+    with APP.app_context():
+        response = apply_caching(Response(mimetype='text/event-stream',
+                                          headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(response.headers.to_wsgi_list())})
+    disconnect = asyncio.ensure_future(request.environ['asgi.receive']())
+    try:
+        while not disconnect.done():
+            event = await subscription.get_async(float(settings.EVENTS_KEEPALIVE))
+            chunk = events.keepalive() if event is None else events.to_sse(event)
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    finally:
+        disconnect.cancel()
+
+
+async def login(request):
+    await juju.authenticate(request.headers['api-key'], request.authorization)
+    return 200, 'Success'
+
+
+async def get_users_info(request):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    return 200, await juju.blocking(juju.get_users_info, token, juju.list_options(request.args, 'state'))
+
+
+async def get_user_info(request, user):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    if not (user == token.username or token.is_admin):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    version = await juju.blocking(juju.get_user_version, user)
+    if juju.is_not_modified(request, version):
+        return 304, None, version
+    return 200, await juju.blocking(juju.get_user_info, user), version
+
+
+async def change_user_password(request, user):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    if not (user == token.username or token.is_admin):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    pwd = request.json['password']
+    if not pwd:
+        return errors.empty()
+    results = await juju.change_user_password(token, user, pwd)
+    failed = juju.fan_out_failed(results)
+    if failed:
+        return 502, {'message': 'Password of user {} could not be changed on controllers {}'.format(user, ', '.join(failed)),
+                     'controllers': results}
+    return 200, {'message': 'Succesfully changed password for user {}'.format(user), 'controllers': results}
+
+
+async def get_user_resource(request, user, read):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    if not (token.is_admin or token.username == user):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    return 200, await juju.blocking(read, user)
+
+
+async def get_ssh_keys(request, user):
+    return await get_user_resource(request, user, juju.get_ssh_keys_user)
+
+
+async def get_credentials(request, user):
+    return await get_user_resource(request, user, juju.get_credentials)
+
+
+async def get_credential(request, user, credential):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    if not (token.is_admin or token.username == user):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    if not await juju.blocking(juju.credential_exists, user, credential):
+        return errors.does_not_exist('credential')
+    return 200, await juju.blocking(juju.get_credential, user, credential)
+
+
+async def get_controllers_access(request, user):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    if token.is_admin or token.username == user:
+        if not await juju.blocking(juju.user_exists, user):
+            return errors.does_not_exist('user')
+        return 200, await juju.blocking(juju.get_controllers_access, user)
+    allowed, access = await juju.blocking(juju.check_controllers_access, token, user)
+    if allowed:
+        return 200, access
+    return errors.no_permission()
+
+
+async def get_ucontroller_access(request, user, controller):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con = await juju.blocking(juju.authorize, token, controller)
+    if not (token.is_admin or token.username == user or con.c_access == 'superuser'):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    return 200, await juju.blocking(juju.get_ucontroller_access, con, user)
+
+
+async def get_models_access(request, user, controller):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con = await juju.blocking(juju.authorize, token, controller)
+    if token.is_admin or token.username == user or con.c_access == 'superuser':
+        if not await juju.blocking(juju.user_exists, user):
+            return errors.does_not_exist('user')
+        return 200, await juju.blocking(juju.get_models_access, con, user)
+    allowed, access = await juju.blocking(juju.check_models_access, token, controller, user)
+    if allowed:
+        return 200, access
+    return errors.no_permission()
+
+
+async def get_model_access(request, user, controller, model):
+    token = await juju.authenticate(request.headers['api-key'], request.authorization)
+    con, mod = await juju.blocking(juju.authorize, token, controller, model)
+    if not (token.is_admin or token.username == user or mod.m_access == 'admin' or con.c_access == 'superuser'):
+        return errors.no_permission()
+    if not await juju.blocking(juju.user_exists, user):
+        return errors.does_not_exist('user')
+    return 200, {'access': await juju.blocking(juju.get_model_access, mod.m_name, con.c_name, user)}
+
+
+MODEL = '/tengu/controllers/<controller>/models/<model>'
+USER = '/users/<user>'
+ROUTES = Map([
+    Rule(MODEL, methods=['GET'], endpoint=get_model_info),
+    Rule(MODEL + '/applications', methods=['GET'], endpoint=get_applications_info),
+    Rule(MODEL + '/applications/<application>', methods=['GET'], endpoint=get_application_info),
+    Rule(MODEL + '/applications/<application>/config', methods=['GET'], endpoint=get_application_config),
+    Rule(MODEL + '/machines', methods=['GET'], endpoint=get_machines_info),
+    Rule(MODEL + '/machines/<machine>', methods=['GET'], endpoint=get_machine_info),
+    Rule(MODEL + '/applications/<application>/units', methods=['GET'], endpoint=get_units_info),
+    Rule(MODEL + '/applications/<application>/units/<unitnumber>', methods=['GET'], endpoint=get_unit_info),
+    Rule(MODEL + '/relations', methods=['GET'], endpoint=get_relations_info),
+    Rule(MODEL + '/relations/<application>', methods=['GET'], endpoint=get_relations),
+    Rule(MODEL + '/events', methods=['GET'], endpoint=get_model_events),
+    Rule(MODEL, methods=['DELETE'], endpoint=delete_model),
+    Rule(MODEL + '/applications', methods=['POST'], endpoint=add_application),
+    Rule(MODEL + '/applications/<application>', methods=['PUT'], endpoint=expose_application),
+    Rule(MODEL + '/applications/<application>', methods=['DELETE'], endpoint=remove_app),
+    Rule(MODEL + '/applications/<application>/config', methods=['PUT'], endpoint=set_application_config),
+    Rule(MODEL + '/machines', methods=['POST'], endpoint=add_machine),
+    Rule(MODEL + '/applications/<application>/units/<unitnumber>', methods=['DELETE'], endpoint=remove_unit),
+    Rule(MODEL + '/relations', methods=['PUT'], endpoint=add_relation),
+    Rule(MODEL + '/relations/<app1>/<app2>', methods=['DELETE'], endpoint=remove_relation),
+    Rule('/users/login', methods=['POST'], endpoint=login),
+    Rule('/users/', methods=['GET'], endpoint=get_users_info),
+    Rule(USER, methods=['GET'], endpoint=get_user_info),
+    Rule(USER, methods=['PUT'], endpoint=change_user_password),
+    Rule(USER + '/ssh-keys', methods=['GET'], endpoint=get_ssh_keys),
+    Rule(USER + '/credentials', methods=['GET'], endpoint=get_credentials),
+    Rule(USER + '/credentials/<credential>', methods=['GET'], endpoint=get_credential),
+    Rule(USER + '/controllers', methods=['GET'], endpoint=get_controllers_access),
+    Rule(USER + '/controllers/<controller>', methods=['GET'], endpoint=get_ucontroller_access),
+    Rule(USER + '/controllers/<controller>/models', methods=['GET'], endpoint=get_models_access),
+    Rule(USER + '/controllers/<controller>/models/<model>', methods=['GET'], endpoint=get_model_access),
+], strict_slashes=False)
+################################################################################
+# ASGI APPLICATION
+################################################################################
+EXECUTOR = ThreadPoolExecutor(int(settings.ASGI_WSGI_THREADS))
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        environ = build_environ(scope, await read_body(receive))
+        try:
+            handler, args = ROUTES.bind_to_environ(environ).match()
+        except HTTPException:
+            result = await asyncio.get_event_loop().run_in_executor(EXECUTOR, call_wsgi, environ)
+        else:
+            # Native handlers that stream get the ASGI channel through the environ.
+            environ['asgi.receive'], environ['asgi.send'] = receive, send
+            result = await call_native(handler, Request(environ), args)
+        if result is not None:
+            status, headers, body = result
+            await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            juju.set_loop(asyncio.get_event_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await juju.close_connections()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def call_native(handler, request, args):
+    url, method = request.path, request.method
+    version = None
+    try:
+        LOGGER.info('%s [%s] => receiving call', url, method)
+        result = await handler(request, **args)
+        if result is None:
+            LOGGER.info('%s [%s] => stream closed', url, method)
+            return None
+        # Handlers of conditional reads also return the version of the response.
+        code, response, version = result if len(result) == 3 else result + (None,)
+        LOGGER.info('%s [%s] => %s', url, method, code)
+    except KeyError:
+        code, response = errors.invalid_data()
+        error_log()
+    except HTTPException as e:
+        error_log()
+        code, response = e.code, e.description
+    except Exception:
+        ers = error_log()
+        code, response = errors.cmd_error(ers)
+    # The response helpers and the after_request hooks of the Flask app expect
+    # an application context, native handlers run outside of Flask.
+    with APP.app_context():
+        response = apply_caching(juju.etag_response(request, version, code, response))
+        response = juju.compress_response(response, request.accept_encodings)
+        return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+
+def encode_headers(headers):
+    return [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+
+def call_wsgi(environ):
+    started = {}
+    def start_response(status, headers, exc_info=None):  #pylint: disable=W0613
+        started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+    result = APP(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], body
+
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_{}'.format(name.upper().replace('-', '_'))
+            environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+    return environ
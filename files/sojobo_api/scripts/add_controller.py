@@ -37,38 +37,50 @@ class JuJu_Token(object):  #pylint: disable=R0903
         self.is_admin = True
 
 
+def bootstrap(c_type, name, region, credential, cred_name, password):
+    # Bootstrapping takes minutes, it runs in an executor thread so the other
+    # jobs on the event loop of the job worker keep going. Logging from here is
+    # not linked to the job, the coroutine logs the steps.
+    juju.get_controller_types()[c_type].create_controller(name, region, credential, 't{}'.format(hashlib.md5(cred_name.encode('utf')).hexdigest()))
+    check_output(['juju', 'change-user-password', 'admin', '-c', name],
+                 input=bytes('{}\n{}\n'.format(password, password), 'utf-8'))
+    with open(os.path.join(str(Path.home()), '.local', 'share', 'juju', 'controllers.yaml'), 'r') as data:
+        return yaml.load(data)['controllers'][name]
+
+
+def add_models(name, cred_name, username, models):
+    for model in models:
+        datastore.add_model_to_controller(name, model['name'])
+        datastore.set_model_state(name, model['name'], 'ready', credential=cred_name, uuid=model['uuid'])
+        datastore.set_model_access(name, model['name'], username, 'admin')
+
+
+def creation_failed(name):
+    datastore.destroy_controller(name)
+    datastore.set_controller_state(name, 'error')
+
+
 async def create_controller(c_type, name, region, cred_name):
     try:
         logger.info('Adding controller to database')
         token = JuJu_Token()
-        datastore.create_controller(name, c_type, region, cred_name)
-        datastore.add_user_to_controller(name, 'admin', 'superuser')
+        await juju.blocking(datastore.create_controller, name, c_type, region, cred_name)
+        await juju.blocking(datastore.add_user_to_controller, name, 'admin', 'superuser')
 
-        logger.info('Bootstrapping controller')
-        credential = juju.get_credential(token.username, cred_name)
+        logger.info('Bootstrapping controller and setting admin password')
+        credential = await juju.blocking(juju.get_credential, token.username, cred_name)
         logger.info('credential found %s:', credential['credential'])
-        juju.get_controller_types()[c_type].create_controller(name, region, credential['credential'], 't{}'.format(hashlib.md5(cred_name.encode('utf')).hexdigest()))
-        pswd = token.password
-
-        logger.info('Setting admin password')
-        check_output(['juju', 'change-user-password', 'admin', '-c', name],
-                     input=bytes('{}\n{}\n'.format(pswd, pswd), 'utf-8'))
+        con_data = await juju.blocking(bootstrap, c_type, name, region, credential['credential'], cred_name, token.password)
 
         logger.info('Updating controller in database')
-        with open(os.path.join(str(Path.home()), '.local', 'share', 'juju', 'controllers.yaml'), 'r') as data:
-            con_data = yaml.load(data)
-        datastore.set_controller_state(
-            name,
-            'ready',
-            con_data['controllers'][name]['api-endpoints'],
-            con_data['controllers'][name]['uuid'],
-            con_data['controllers'][name]['ca-cert'])
+        await juju.blocking(datastore.set_controller_state, name, 'ready', con_data['api-endpoints'],
+                            con_data['uuid'], con_data['ca-cert'])
 
         logger.info('Connecting to controller')
-        controller = juju.Controller_Connection(token, name)
+        controller = await juju.blocking(juju.Controller_Connection, token, name)
 
         logger.info('Adding existing credentials and models to database')
-        credentials = datastore.get_credentials(token.username)
+        credentials = await juju.blocking(datastore.get_credentials, token.username)
         async with controller.connect(token) as juju_con:
             for cred in credentials:
                 if cred['name'] != cred_name:
@@ -81,20 +93,15 @@ async def create_controller(c_type, name, region, cred_name):
                     )
                     await cloud_facade.UpdateCredentials([cloud_cred])
             models = await juju_con.get_models()
-            for model in models.serialize()['user-models']:
-                model = model.serialize()['model'].serialize()
-                datastore.add_model_to_controller(name, model['name'])
-                datastore.set_model_state(name, model['name'], 'ready', credential=cred_name, uuid=model['uuid'])
-                datastore.set_model_access(name, model['name'], token.username, 'admin')
+            models = [model.serialize()['model'].serialize() for model in models.serialize()['user-models']]
+        await juju.blocking(add_models, name, cred_name, token.username, models)
         logger.info('Controller succesfully created!')
     except Exception:  #pylint: disable=W0703
-        datastore.destroy_controller(name)
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
-        datastore.set_controller_state(name, 'error')
-
+        await juju.blocking(creation_failed, name)
 
 if __name__ == '__main__':
     logger = logging.getLogger('add-controller')
@@ -107,4 +114,5 @@ if __name__ == '__main__':
     loop.set_debug(False)
     loop.run_until_complete(create_controller(sys.argv[1], sys.argv[2],
                                               sys.argv[3], sys.argv[4]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
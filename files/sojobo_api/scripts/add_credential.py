@@ -77,4 +77,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
     loop.run_until_complete(add_credential(sys.argv[1], sys.argv[2]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
@@ -23,8 +23,6 @@ sys.path.append('/opt')
 from juju import tag
 from sojobo_api import settings  #pylint: disable=C0413
 from sojobo_api.api import w_datastore as ds, w_juju as juju  #pylint: disable=C0413
-from juju.client import client
-from juju.errors import JujuAPIError, JujuError
 
 class JuJu_Token(object):  #pylint: disable=R0903
     def __init__(self):
@@ -52,22 +50,29 @@ async def create_model(c_name, m_name, usr, pwd, cred_name):
             logger.info('%s -> model deployed on juju', m_name)
             ds.set_model_access(c_name, m_name, usr, 'admin')
             ds.set_model_state(c_name, m_name, 'ready', cred_name, model.info.uuid)
-            logger.info('%s -> Adding ssh-keys to model: %s', m_name, m_name)
-            for key in ds.get_ssh_keys(usr):
-                try:
-                    await model.add_ssh_key(usr, key)
-                except (JujuAPIError, JujuError):
-                    pass
             logger.info('%s -> retrieving users: %s', m_name, ds.get_controller_users(c_name))
-            for u in ds.get_controller_users(c_name):
-                if u['access'] == 'superuser' and u['name'] != usr:
-                    await model.grant(u['name'], acl='admin')
-                    ds.set_model_access(c_name, m_name, u['name'], 'admin')
-                    for key in ds.get_ssh_keys(u['name']):
-                        try:
-                            await model.add_ssh_key(u['name'], key['key'])
-                        except (JujuAPIError, JujuError):
-                            pass
+            superusers = [u['name'] for u in ds.get_controller_users(c_name)
+                          if u['access'] == 'superuser' and u['name'] != usr]
+            # All superusers are granted with one call, the ssh-keys of every
+            # user are added with one call per user, all users at once.
+            res = await juju.modify_models_access(con_juju, 'grant', [(u, model.info.uuid, 'admin') for u in superusers])
+            granted = [usr]
+            for u, error in zip(superusers, res):
+                if error:
+                    logger.error('%s -> granting %s failed: %s', m_name, u, error)
+                else:
+                    ds.set_model_access(c_name, m_name, u, 'admin')
+                    granted.append(u)
+            logger.info('%s -> Adding ssh-keys to model: %s', m_name, m_name)
+            ssh_keys = {u: ds.get_ssh_keys(u) for u in granted}
+            for u, keys in ssh_keys.items():
+                for key in juju.invalid_ssh_keys(keys):
+                    logger.warning('%s -> skipping malformed ssh-key of %s: %s', m_name, u, key)
+            users = [u for u, keys in ssh_keys.items() if keys]
+            res = await asyncio.gather(*[juju.update_models_ssh_keys(token, c_name, [m_name], u, ssh_keys[u]) for u in users])
+            for u, results in zip(users, res):
+                if juju.fan_out_failed(results):
+                    logger.warning('%s -> adding ssh-keys of %s failed: %s', m_name, u, results[m_name]['error'])
             logger.info('%s -> succesfully deployed model', m_name)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -81,7 +86,6 @@ async def create_model(c_name, m_name, usr, pwd, cred_name):
     finally:
         if 'model' in locals():
             await model.disconnect()
-        await controller.disconnect()
 
 
 if __name__ == '__main__':
@@ -99,4 +103,5 @@ if __name__ == '__main__':
     loop.set_debug(True)
     loop.run_until_complete(create_model(sys.argv[1], sys.argv[2], sys.argv[4],
                                          sys.argv[5], sys.argv[6]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
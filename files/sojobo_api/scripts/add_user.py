@@ -36,17 +36,21 @@ async def create_user(username, password):
     try:
         datastore.create_user(username)
         logger.info('Succesfully created user %s', username)
-        controllers = datastore.get_all_controllers()
         token = JuJu_Token()
-        for con in controllers:
+        async def add_to_controller(con):
             logger.info('Setting up Controllerconnection for %s', con)
             controller = juju.Controller_Connection(token, con)
             async with controller.connect(token) as con_juju:  #pylint: disable=E1701
                 await con_juju.add_user(username, password)
                 await con_juju.grant(username)
-                datastore.add_user_to_controller(con, username, 'login')
-                logger.info('Succesfully added user %s to controller %s', username, con)
-        datastore.set_user_state(username, 'ready')
+            datastore.add_user_to_controller(con, username, 'login')
+            logger.info('Succesfully added user %s to controller %s', username, con)
+        results = await juju.fan_out(datastore.get_all_controllers(), add_to_controller)
+        failed = juju.fan_out_failed(results)
+        for con in failed:
+            logger.error('Adding user %s to controller %s failed: %s', username, con, results[con]['error'])
+        if not failed:
+            datastore.set_user_state(username, 'ready')
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
@@ -68,4 +72,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(False)
     loop.run_until_complete(create_user(sys.argv[1], sys.argv[2]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
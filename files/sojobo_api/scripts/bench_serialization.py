@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
+# Compares the JSON backends, the MessagePack codec of the datastore and the
+# response compressions on payloads shaped like the model info and user
+# listings of the API, e.g.:
+#     python3.6 bench_serialization.py 200 500
+# benchmarks a model of 200 applications and a listing of 500 users.
+import gzip
+import sys
+import timeit
+import zlib
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+sys.path.append('/opt')
+from sojobo_api.api import w_json as serializer  #pylint: disable=C0413
+
+
+def model_info(applications):
+    machines = [{'name': str(i), 'instance-id': 'juju-4f2a1c-{}'.format(i), 'ip': ['10.10.{}.{}'.format(i // 250, i % 250)],
+                 'series': 'xenial', 'hardware-characteristics': {'arch': 'amd64', 'cpu-cores': 4, 'mem': 8192},
+                 'containers': [], 'units': [], 'status': {'current': 'started', 'message': '', 'since': '2017-11-02T10:21:07Z'}}
+                for i in range(applications * 2)]
+    apps = []
+    for i in range(applications):
+        units = [{'name': 'app-{}/{}'.format(i, u), 'machine': str(i * 2 + u), 'public-ip': machines[i * 2 + u]['ip'][0],
+                  'private-ip': machines[i * 2 + u]['ip'][0], 'series': 'xenial', 'ports': [{'number': 8080, 'protocol': 'tcp'}],
+                  'workload-status': {'current': 'active', 'message': 'Ready', 'since': '2017-11-02T10:21:07Z'},
+                  'agent-status': {'current': 'idle', 'message': '', 'since': '2017-11-02T10:21:07Z'}}
+                 for u in range(2)]
+        apps.append({'name': 'app-{}'.format(i), 'charm': 'cs:xenial/app-{}-12'.format(i), 'series': 'xenial',
+                     'exposed': i % 3 == 0, 'units': units,
+                     'relations': [{'interface': 'http', 'with': 'app-{}'.format(i + 1)}],
+                     'status': {'current': 'active', 'message': 'Ready', 'since': '2017-11-02T10:21:07Z'}})
+    return {'name': 'production', 'status': 'available', 'credentials': {'name': 'admin-aws', 'type': 'access-key'},
+            'users': [{'name': 'admin', 'access': 'admin'}], 'applications': apps, 'machines': machines}
+
+
+def user_listing(users):
+    return [{'name': 'user-{}'.format(i), 'state': 'ready',
+             'ssh-keys': ['ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQC{} user-{}@tengu'.format('x' * 340, i)],
+             'credentials': [{'name': 'aws-{}'.format(i), 'type': 'aws', 'state': 'ready'}],
+             'controllers': [{'name': 'controller-{}'.format(c), 'access': 'login',
+                              'models': [{'name': 'model-{}'.format(m), 'access': 'write'} for m in range(10)]}
+                             for c in range(3)]}
+            for i in range(users)]
+
+
+def bench(label, payload, number):
+    print('{} ({} bytes as JSON)'.format(label, len(serializer.json_dumps(payload))))
+    codecs = dict(serializer.BACKENDS)
+    if msgpack is not None:
+        codecs['msgpack'] = (lambda obj: msgpack.packb(obj, use_bin_type=True), lambda data: msgpack.unpackb(data, raw=False))
+    baseline = None
+    for name in ['json', 'ujson', 'orjson', 'msgpack']:
+        if name not in codecs:
+            print('  {:<8} not installed'.format(name))
+            continue
+        encode, decode = codecs[name]
+        data = encode(payload)
+        dumps = timeit.timeit(lambda: encode(payload), number=number) / number
+        loads = timeit.timeit(lambda: decode(data), number=number) / number
+        baseline = baseline or (dumps, loads)
+        print('  {:<8} dumps {:8.3f} ms ({:4.1f}x)  loads {:8.3f} ms ({:4.1f}x)  {:9d} bytes'.format(
+            name, dumps * 1000, baseline[0] / dumps, loads * 1000, baseline[1] / loads, len(data)))
+    data = serializer.dumps_bytes(payload)
+    for name, compress in [('gzip', gzip.compress), ('deflate', zlib.compress)]:
+        for level in [1, 6, 9]:
+            size = len(compress(data, level))
+            seconds = timeit.timeit(lambda: compress(data, level), number=number) / number
+            print('  {:<8} level {}  {:9d} bytes ({:5.1f}%)  {:8.3f} ms'.format(
+                name, level, size, 100.0 * size / len(data), seconds * 1000))
+
+
+if __name__ == '__main__':
+    applications = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    number = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    bench('Model info of {} applications'.format(applications), model_info(applications), number)
+    bench('Listing of {} users'.format(users), user_listing(users), number)
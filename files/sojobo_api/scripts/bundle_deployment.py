@@ -23,9 +23,9 @@ import traceback
 import ast
 import logging
 import yaml
-import redis
-import json
+sys.path.append('/opt')
 from juju.model import Model
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
 ################################################################################
 # Helper Functions
 ################################################################################
@@ -34,7 +34,7 @@ def quoted_presenter(dumper, data):
 ################################################################################
 # Async Functions
 ################################################################################
-async def deploy_bundle(username, password, controller_name, model_name, bundle, url, port):
+async def deploy_bundle(username, password, controller_name, model_name, bundle):
     try:
         logger.info('Authenticated and starting bundle deployment!')
         dirpath = tempfile.mkdtemp()
@@ -46,8 +46,7 @@ async def deploy_bundle(username, password, controller_name, model_name, bundle,
         with open('{}/bundle/README.md'.format(dirpath), 'w+') as readmefile:
             readmefile.write('##Overview')
         logger.info('Tmp file created and ready to be deployed! %s', outfile)
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
-        con = json.loads(controllers.get(controller_name))
+        con = datastore.get_controller(controller_name)
         for mod in con['models']:
             if mod['name'] == model_name:
                 logger.info('Setting up Modelconnection for model: %s', model_name)
@@ -82,5 +81,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
     loop.run_until_complete(deploy_bundle(sys.argv[1], sys.argv[2], sys.argv[4],
-                                          sys.argv[5], sys.argv[6], sys.argv[7], sys.argv[8]))
+                                          sys.argv[5], sys.argv[6]))
     loop.close()
@@ -38,9 +38,8 @@ async def delete_user(username):
     try:
         token = JuJu_Token()
         #TO DO => libjuju implementation
-        controllers = datastore.get_all_controllers()
         datastore.set_user_state(username, 'deleting')
-        for con in controllers:
+        async def remove_from_controller(con):
             logger.info('Setting up Controllerconnection for %s', con)
             controller = juju.Controller_Connection(token, con)
             async with controller.connect(token) as con_juju:
@@ -51,7 +50,12 @@ async def delete_user(username):
                 # if wrapper ready =>
                 # await con_juju.remove(username)
             logger.info('Removed user %s from Controller %s', username ,con)
-        datastore.delete_user(username)
+        results = await juju.fan_out(datastore.get_all_controllers(), remove_from_controller)
+        failed = juju.fan_out_failed(results)
+        for con in failed:
+            logger.error('Removing user %s from controller %s failed: %s', username, con, results[con]['error'])
+        if not failed:
+            datastore.delete_user(username)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
@@ -72,4 +76,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(False)
     loop.run_until_complete(delete_user(sys.argv[1]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
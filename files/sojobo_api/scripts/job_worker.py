@@ -0,0 +1,144 @@
+#!/usr/bin/env python3.6
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302,e0611
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from importlib import import_module
+import logging
+import signal
+import socket
+import sys
+import threading
+import traceback
+sys.path.append('/opt')
+from sojobo_api import settings  #pylint: disable=C0413
+from sojobo_api.api import w_jobs as jobs, w_juju as juju  #pylint: disable=C0413
+################################################################################
+# JOB WORKER
+################################################################################
+# Runs the jobs of the Redis queue with the scripts in this directory. The
+# scripts are imported once and their entry points are awaited on one event
+# loop, so jobs share the pooled Juju and Redis connections of this process
+# instead of each starting a new interpreter.
+RUNNING = {}
+# Scripts with a plain function run in an executor thread, outside of any task,
+# so the job is handed to that thread.
+THREAD_JOB = threading.local()
+
+
+class JobProgress(logging.Handler):
+    # The steps a script logs become the progress of the job running in the
+    # current task or executor thread, logged errors make the job fail.
+    def emit(self, record):
+        job = getattr(THREAD_JOB, 'job', None)
+        if job is None:
+            try:
+                task = asyncio.Task.current_task()
+                job = RUNNING.get(juju.TASK_PARENTS.get(task, task)) if task else None
+            except RuntimeError:
+                job = None
+        if job is None:
+            return
+        if record.levelno >= logging.ERROR:
+            job['errors'].append(record.getMessage())
+        else:
+            jobs.progress(job['id'], record.getMessage())
+
+
+def load_scripts():
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    scripts = {}
+    for name in jobs.SCRIPTS:
+        script = import_module(name)
+        hdlr = logging.FileHandler('{}/log/{}.log'.format(settings.SOJOBO_API_DIR, name))
+        hdlr.setFormatter(formatter)
+        script.logger = logging.getLogger(name)
+        script.logger.addHandler(hdlr)
+        script.logger.addHandler(JobProgress())
+        script.logger.setLevel(logging.INFO)
+        scripts[name] = script
+    return scripts
+
+
+async def run_job(scripts, job):
+    function = getattr(scripts[job['script']], job['function'])
+    if asyncio.iscoroutinefunction(function):
+        await function(*job['args'])
+    else:
+        running = RUNNING[asyncio.Task.current_task()]
+        await asyncio.get_event_loop().run_in_executor(None, partial(run_in_thread, running, function, *job['args']))
+
+
+def run_in_thread(running, function, *args):
+    THREAD_JOB.job = running
+    try:
+        function(*args)
+    finally:
+        THREAD_JOB.job = None
+
+
+async def consume(worker, scripts, executor, stopping):
+    loop = asyncio.get_event_loop()
+    while not stopping.is_set():
+        job = await loop.run_in_executor(executor, jobs.claim, worker, int(settings.JOB_POLL_TIMEOUT))
+        if job is None:
+            continue
+        logger.info('%s -> running %s.%s', job['id'], job.get('script'), job.get('function'))
+        task = asyncio.Task.current_task()
+        RUNNING[task] = {'id': job['id'], 'errors': []}
+        try:
+            if job.get('script') not in scripts:
+                raise ValueError('Unknown script {}'.format(job.get('script')))
+            await run_job(scripts, job)
+        except Exception:  #pylint: disable=W0703
+            lines = traceback.format_exception(*sys.exc_info())
+            for l in lines:
+                logger.error(l)
+            RUNNING[task]['errors'].extend(lines)
+        finally:
+            errors = RUNNING.pop(task)['errors']
+        logger.info('%s -> %s', job['id'], 'failed' if errors else 'done')
+        jobs.finish(worker, job['id'], ''.join(errors) or None)
+
+
+def run_worker(worker, concurrency):
+    scripts = load_scripts()
+    logger.info('%s -> requeued %s', worker, jobs.recover(worker))
+    loop = asyncio.get_event_loop()
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    loop.add_signal_handler(signal.SIGHUP, juju.reload_controller_types)
+    # Every consumer blocks on the queue in its own thread, so at most
+    # `concurrency` jobs are taken from Redis and held in memory at once.
+    executor = ThreadPoolExecutor(concurrency)
+    consumers = [consume(worker, scripts, executor, stopping) for _ in range(concurrency)]
+    logger.info('%s -> started %s consumers', worker, concurrency)
+    loop.run_until_complete(asyncio.gather(*consumers))
+    loop.run_until_complete(juju.close_connections())
+    loop.close()
+    logger.info('%s -> stopped', worker)
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger('job-worker')
+    hdlr = logging.FileHandler('{}/log/job_worker.log'.format(settings.SOJOBO_API_DIR))
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    hdlr.setFormatter(formatter)
+    logger.addHandler(hdlr)
+    logger.setLevel(logging.INFO)
+    run_worker(socket.gethostname(), int(sys.argv[1]) if len(sys.argv) > 1 else int(settings.JOB_WORKERS))
@@ -0,0 +1,46 @@
+# !/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
+import logging
+import traceback
+import sys
+sys.path.append('/opt')
+from sojobo_api import settings  #pylint: disable=C0413
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+
+
+def rebuild_indexes(batch_size):
+    try:
+        logger.info('Rebuilding user and controller indexes')
+        for name, result in datastore.rebuild_indexes(batch_size).items():
+            logger.info('%s -> %s', name, result)
+        logger.info('Succesfully rebuilt indexes!')
+    except Exception:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
+        for l in lines:
+            logger.error(l)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    logger = logging.getLogger('rebuild-indexes')
+    hdlr = logging.FileHandler('{}/log/rebuild_indexes.log'.format(settings.SOJOBO_API_DIR))
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    hdlr.setFormatter(formatter)
+    logger.addHandler(hdlr)
+    logger.setLevel(logging.INFO)
+    rebuild_indexes(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
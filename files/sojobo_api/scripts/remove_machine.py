@@ -18,15 +18,14 @@ import asyncio
 import sys
 import traceback
 import logging
-import json
-import redis
+sys.path.append('/opt')
 from juju.model import Model
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
 
 
-async def remove_machine(c_name, m_name, usr, pwd, url, port, machine):
+async def remove_machine(c_name, m_name, usr, pwd, machine):
     try:
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
-        controller = json.loads(controllers.get(c_name))
+        controller = datastore.get_controller(c_name)
         model = Model()
         logger.info('Setting up Model connection for %s:%s', c_name, m_name)
         for mod in controller['models']:
@@ -61,5 +60,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
     loop.run_until_complete(remove_machine(sys.argv[6], sys.argv[7], sys.argv[1],
-                                         sys.argv[2], sys.argv[4], sys.argv[5], sys.argv[8]))
+                                         sys.argv[2], sys.argv[8]))
     loop.close()
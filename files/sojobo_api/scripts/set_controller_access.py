@@ -77,4 +77,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
     result = loop.run_until_complete(set_controller_acc(sys.argv[1], sys.argv[2], sys.argv[4]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
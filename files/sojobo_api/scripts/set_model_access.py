@@ -21,7 +21,6 @@ import traceback
 import logging
 sys.path.append('/opt')
 from sojobo_api.api import w_datastore as datastore, w_juju as juju  #pylint: disable=C0413
-from juju.errors import JujuAPIError, JujuError
 
 class JuJu_Token(object):  #pylint: disable=R0903
     def __init__(self):
@@ -36,27 +35,36 @@ async def set_model_acc(username, password, user, access, controller):
         token.password = password
         access_list = ast.literal_eval(access)
         ssh_keys = datastore.get_ssh_keys(user)
-        for mod in access_list:
-            logger.info('setting Model Access for %s on %s!', user, mod['name'])
-            model = juju.Model_Connection(token, controller, mod['name'])
-            async with model.connect(token) as mod_con:
-                current_access = datastore.get_model_access(controller, mod['name'], user)
-                logger.info('Current Access level: %s', current_access)
-                if current_access:
-                    await mod_con.revoke(user)
-                await mod_con.grant(user, acl=mod['access'])
-                if mod['access'] in ['admin', 'write']:
-                    for key in ssh_keys:
-                        try:
-                            logger.info('Adding ssh-key: %s', key)
-                            mod_con.add_ssh_key(user, key)
-                        except (JujuAPIError, JujuError):
-                            exc_type, exc_value, exc_traceback = sys.exc_info()
-                            lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
-                            for l in lines:
-                                logger.error(l)
-            datastore.set_model_access(controller, mod['name'], user, mod['access'])
-            logger.info('Model Access set for %s on %s!', user, mod['name'])
+        models = [(mod['name'], datastore.get_model(controller, mod['name'])['uuid'], mod['access'],
+                   datastore.get_model_access(controller, mod['name'], user)) for mod in access_list]
+        # Access to all models of the controller is revoked and granted with
+        # one call each, instead of a connection and two calls per model.
+        con = juju.Controller_Connection(token, controller)
+        async with con.connect(token) as con_juju:  #pylint: disable=E1701
+            revoke = [(m_name, uuid) for m_name, uuid, _, current in models if current]
+            logger.info('Revoking current access of %s on %s models', user, len(revoke))
+            res = await juju.modify_models_access(con_juju, 'revoke', [(user, uuid, 'read') for _, uuid in revoke])
+            for (m_name, _), error in zip(revoke, res):
+                if error:
+                    logger.error('Revoking access of %s on %s failed: %s', user, m_name, error)
+            logger.info('Granting access to %s on %s models', user, len(models))
+            res = await juju.modify_models_access(con_juju, 'grant', [(user, uuid, acl) for _, uuid, acl, _ in models])
+        key_models = []
+        for (m_name, _, acl, _), error in zip(models, res):
+            if error:
+                logger.error('Setting Model Access for %s on %s failed: %s', user, m_name, error)
+                continue
+            datastore.set_model_access(controller, m_name, user, acl)
+            logger.info('Model Access set for %s on %s!', user, m_name)
+            if acl in ['admin', 'write']:
+                key_models.append(m_name)
+        if ssh_keys and key_models:
+            logger.info('Adding ssh-keys of %s to %s models', user, len(key_models))
+            for key in juju.invalid_ssh_keys(ssh_keys):
+                logger.warning('Skipping malformed ssh-key %s', key)
+            results = await juju.update_models_ssh_keys(token, controller, key_models, user, ssh_keys)
+            for m_name in juju.fan_out_failed(results):
+                logger.error('Adding ssh-keys to %s failed: %s', m_name, results[m_name]['error'])
     except Exception:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
@@ -79,4 +87,5 @@ if __name__ == '__main__':
     loop.set_debug(True)
     result = loop.run_until_complete(set_model_acc(sys.argv[1], sys.argv[2],
                                                    sys.argv[4], sys.argv[5], sys.argv[6]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
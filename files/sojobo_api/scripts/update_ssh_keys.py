@@ -36,19 +36,20 @@ async def remove_ssh_key(ssh_keys, username):
         new_keys = ast.literal_eval(ssh_keys)
         user = datastore.get_user(username)
         token = JuJu_Token()
+        for key in juju.invalid_ssh_keys(new_keys + current_keys):
+            logger.warning('Skipping malformed ssh-key %s', key)
+        # The old keys are removed and the new ones added with one call each
+        # per model, and all models of a controller are updated concurrently.
+        failed = []
         for con in user['controllers']:
-            for mod in con['models']:
-                if mod['access'] == 'write' or mod['access'] == 'admin':
-                    logger.info('Setting up Modelconnection for model: %s', mod['name'])
-                    model = juju.Model_Connection(token, con['name'], mod['name'])
-                    async with model.connect(token) as mod_con:
-                        for a_key in current_keys:
-                            logger.info('removing key: %s', a_key)
-                            await mod_con.remove_ssh_key(username, a_key)
-                        for r_key in new_keys:
-                            logger.info('adding key: %s', r_key)
-                            await mod_con.add_ssh_key(username, r_key)
-        datastore.update_ssh_keys(username, new_keys)
+            models = [mod['name'] for mod in con['models'] if mod['access'] in ['write', 'admin']]
+            logger.info('Updating ssh-keys on %s models of controller %s', len(models), con['name'])
+            results = await juju.update_models_ssh_keys(token, con['name'], models, username, new_keys, current_keys)
+            for m_name in juju.fan_out_failed(results):
+                logger.error('Updating ssh-keys on %s failed: %s', m_name, results[m_name]['error'])
+                failed.append(m_name)
+        if not failed:
+            datastore.update_ssh_keys(username, new_keys)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
@@ -70,4 +71,5 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     loop.set_debug(True)
     result = loop.run_until_complete(remove_ssh_key(sys.argv[1], sys.argv[2]))
+    loop.run_until_complete(juju.close_connections())
     loop.close()
@@ -17,19 +17,28 @@
 import os
 import logging
 import logging.handlers
+from flask import g, request
 from sojobo_api import settings
 from sojobo_api.app import APP, create_response, redirect
+from sojobo_api.api.w_juju import compress_response
 ########################################################################################################################
 # HEADERS SETUP
 ########################################################################################################################
 @APP.after_request
 def apply_caching(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Authorization,Content-Type,Location,api-key'
-    response.headers['Access-Control-Expose-Headers'] = 'Content-Type,Location'
+    response.headers['Access-Control-Allow-Headers'] = 'Authorization,Content-Type,Location,api-key,If-None-Match'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Type,Location,X-Next-Cursor,ETag'
     response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS'
     response.headers['Accept'] = 'application/json'
+    if response.status_code == 202 and g.get('jobs'):
+        response.headers['Location'] = '/jobs/{}'.format(g.jobs[-1])
     return response
+
+
+@APP.after_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
 ########################################################################################################################
 # ERROR HANDLERS
 ########################################################################################################################
@@ -61,6 +70,16 @@ def method_not_allowed(error):
 @APP.errorhandler(409)
 def conflict(error):
     return create_response(409, error.description)
+
+
+@APP.errorhandler(503)
+def service_unavailable(error):
+    return create_response(503, error.description)
+
+
+@APP.errorhandler(504)
+def gateway_timeout(error):
+    return create_response(504, error.description)
 ########################################################################################################################
 # START FLASK SERVER
 ########################################################################################################################
@@ -23,8 +23,8 @@ import subprocess
 from charmhelpers.core import unitdata
 from charmhelpers.core.templating import render
 from charmhelpers.core.hookenv import status_set, log, config, open_port, close_port, unit_private_ip, application_version_set, leader_get, leader_set
-from charmhelpers.core.host import service_restart, chownr, adduser
-from charms.reactive import hook, when, when_not, set_state, remove_state
+from charmhelpers.core.host import service_restart, service_stop, chownr, adduser
+from charms.reactive import hook, when, when_not, set_state, remove_state, is_state
 import charms.leadership
 
 
@@ -51,6 +51,8 @@ def upgrade_charm():
     log('Updating Sojobo API')
     install_api()
     set_state('api.installed')
+    remove_state('datastore.indexed')
+    remove_state('worker.running')
     status_set('active', 'admin-password: {} api-key: {}'.format(db.get('password'), db.get('api-key')))
 
 
@@ -131,6 +133,32 @@ def create_admin():
         leader_set({'admin': 'Created'})
 
 
+@when('api.running')
+@when_not('worker.running')
+def start_worker():
+    render('sojobo-worker.service', '/etc/systemd/system/sojobo-worker.service',
+           {'user': USER, 'group': GROUP, 'rootdir': API_DIR})
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    subprocess.check_call(['systemctl', 'enable', 'sojobo-worker'])
+    service_restart('sojobo-worker')
+    set_state('worker.running')
+
+
+@when('leadership.is_leader', 'api.running')
+@when_not('datastore.migrated')
+def migrate_datastore():
+    subprocess.check_call(["python3.6", "{}/scripts/migrate_datastore.py".format(API_DIR)])
+    set_state('datastore.migrated')
+    set_state('datastore.indexed')
+
+
+@when('leadership.is_leader', 'api.running')
+@when_not('datastore.indexed')
+def index_datastore():
+    subprocess.check_call(["python3.6", "{}/scripts/rebuild_indexes.py".format(API_DIR)])
+    set_state('datastore.indexed')
+
+
 @when('api.running')
 @when_not('leadership.is_leader')
 def status_update_not_leader():
@@ -143,6 +171,10 @@ def status_update_not_leader():
 @when_not('redis.available')
 def redis_db_removed():
     remove_state('api.running')
+    remove_state('datastore.indexed')
+    if is_state('worker.running'):
+        service_stop('sojobo-worker')
+        remove_state('worker.running')
     remove_state('admin.created')
     status_set('blocked', 'Waiting for a connection with redis')
 
@@ -188,6 +220,9 @@ def install_api():
                 'gitpython', 'redis', 'asyncio_extras', 'requests']:
         subprocess.check_call(['python3.6', '-m', 'pip', 'install', pkg])
     subprocess.check_call(['python3.6', '-m', 'pip', 'install', 'juju==0.6.1'])
+    # Faster JSON backends and MessagePack are optional, the API falls back to the stdlib.
+    for pkg in ['orjson', 'ujson', 'msgpack']:
+        subprocess.call(['python3.6', '-m', 'pip', 'install', pkg])
     mergecopytree('files/sojobo_api', API_DIR)
     if not os.path.isdir('{}/files'.format(API_DIR)):
         os.mkdir('{}/files'.format(API_DIR))
@@ -9,3 +9,46 @@ REDIS_HOST = '{{REDIS_HOST}}'
 REDIS_PORT = '{{REDIS_PORT}}'
 REPO_NAME = '{{REPO_NAME}}'
 SOJOBO_API_PORT = '{{SOJOBO_API_PORT}}'
+REDIS_POOL_SIZE = 50
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 10
+REDIS_CONNECT_TIMEOUT = 5
+REDIS_TX_RETRIES = 10
+AUTH_CACHE_TTL = 300
+JUJU_POOL_MAX_PER_CONTROLLER = 20
+JUJU_POOL_IDLE_TIMEOUT = 300
+JUJU_POOL_MAX_AGE = 3600
+JUJU_POOL_CONNECT_RETRIES = 3
+JUJU_POOL_BACKOFF = 0.5
+JUJU_TASK_TIMEOUT = 300
+ASGI_WSGI_THREADS = 20
+JUJU_STATE_CACHE = True
+JUJU_STATE_CACHE_IDLE = 600
+JUJU_STATE_SYNC_TIMEOUT = 10
+JOB_WORKERS = 8
+JOB_QUEUE_MAX = 10000
+JOB_POLL_TIMEOUT = 5
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION = 86400
+JOB_ARGS_TTL = 3600
+JOB_HISTORY = 1000
+EVENTS_QUEUE_SIZE = 1000
+EVENTS_KEEPALIVE = 15
+EVENTS_POLL_TIMEOUT = 30
+AUTHORIZE_CACHE_SIZE = 5000
+AUTHORIZE_CACHE_TTL = 60
+JUJU_FANOUT_CONCURRENCY = 10
+JUJU_FANOUT_TIMEOUT = 120
+BUNDLE_API_URL = 'https://api.github.com'
+BUNDLE_RAW_URL = 'https://raw.githubusercontent.com'
+BUNDLE_INDEX = '{{SOJOBO_API_DIR}}/bundles.json'
+BUNDLE_REFRESH_INTERVAL = 600
+BUNDLE_FETCH_WORKERS = 8
+BUNDLE_FETCH_TIMEOUT = 10
+LIST_MAX_LIMIT = 500
+ETAG_CACHE_SIZE = 10000
+ETAG_CACHE_TTL = 3600
+JSON_BACKEND = 'auto'
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+DATASTORE_CODEC = 'json'